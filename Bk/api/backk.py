@@ -1,33 +1,554 @@
-import uvicorn
+import time
+_IMPORT_STARTED = time.perf_counter()  # Cold-start measurement; keep this first
+
 import base64
+import binascii
 import json
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response, Request, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
-import requests
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any, Tuple, Type
+import asyncio
+import contextvars
+import hashlib
+import heapq
+import httpx
+import io
+import ipaddress
+import logging
+import math
 import os
+import random
+import socket
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
 
 from dotenv import load_dotenv
+try:
+    import orjson  # Optional; faster parsing of model output
+except ImportError:
+    orjson = None
 from enum import Enum
 import re
-from datetime import datetime
+from urllib.parse import urlsplit
 from pathlib import Path
 
 # Load environment variables
 BASE_DIR = Path(__file__).resolve().parent
+logger = logging.getLogger("smartdoc")
 load_dotenv(BASE_DIR / '.env')
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise RuntimeError("OPENAI_API_KEY is not set. Please add it to Bk/api/.env or the deployment environment.")
 
-app = FastAPI()
+# Upstream (OpenRouter) client settings
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+OPENROUTER_TIMEOUT = float(os.getenv("OPENROUTER_TIMEOUT", "60"))
+OPENROUTER_CONNECT_TIMEOUT = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "10"))
+OPENROUTER_MAX_CONNECTIONS = int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "200"))
+OPENROUTER_MAX_KEEPALIVE = int(os.getenv("OPENROUTER_MAX_KEEPALIVE", "50"))
+OPENROUTER_MAX_CONCURRENCY = int(os.getenv("OPENROUTER_MAX_CONCURRENCY", "500"))  # Per worker
+OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "openai/gpt-4o-mini")  # Vision-capable model
+# Ordered vision models tried after the primary one, comma separated
+OPENROUTER_FALLBACK_MODELS = [m.strip() for m in os.getenv("OPENROUTER_FALLBACK_MODELS", "").split(",") if m.strip()]
+# OpenRouter usage accounting: adds the cost of each call to its usage block (and a usage chunk to streams).
+# Turn off for OpenAI-compatible upstreams that reject unknown parameters.
+OPENROUTER_USAGE_ACCOUNTING = os.getenv("OPENROUTER_USAGE_ACCOUNTING", "1") == "1"
+USAGE_PARAMS: Dict[str, Any] = {"usage": {"include": True}} if OPENROUTER_USAGE_ACCOUNTING else {}
+
+# Upstream resilience settings
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))  # Per model
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))  # Retries earned per request
+RETRY_BUDGET_MIN = float(os.getenv("RETRY_BUDGET_MIN", "10"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+HEDGE_DELAY = os.getenv("HEDGE_DELAY")  # Fixed hedge delay in seconds; default is the model's p95
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "20"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+# Result cache settings
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "86400"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB")  # Optional SQLite path for a persistent tier
+# Rows kept in the SQLite tier; expired and excess rows are deleted at most once per prune interval
+RESULT_CACHE_DB_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_DB_MAX_ENTRIES", str(RESULT_CACHE_MAX_ENTRIES)))
+RESULT_CACHE_PRUNE_INTERVAL = float(os.getenv("RESULT_CACHE_PRUNE_INTERVAL", "300"))
+
+# Image normalization settings
+IMAGE_NORMALIZE = os.getenv("IMAGE_NORMALIZE", "1") == "1"
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1600"))  # Enough for card text
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(50_000_000)))
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG").upper()  # JPEG or WEBP
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+
+# Batch extraction settings
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+# Background job queue settings
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "1000"))
+JOB_STORE = os.getenv("JOB_STORE", "memory")  # memory or sqlite
+JOB_DB = os.getenv("JOB_DB", str(BASE_DIR / "jobs.db"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+JOB_PRUNE_INTERVAL = float(os.getenv("JOB_PRUNE_INTERVAL", "60"))  # How often finished jobs past the TTL are deleted
+JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", "10"))
+# Comma-separated callback hosts (".example.com" also matches subdomains). When set, only these are
+# called; otherwise any host that resolves to a public address is allowed
+JOB_CALLBACK_ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if h.strip()]
+# A running job whose worker died is re-queued once its lease expires; longer than any single extraction
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))
+
+# Rate limiting and admission control
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_RPS = float(os.getenv("RATE_LIMIT_RPS", "5"))  # Sustained extractions per second per client
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "20"))
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB")  # Optional SQLite path to share buckets between workers
+# Comma-separated X-API-Key values that get their own bucket and may pick their lane with X-Priority;
+# everyone else is limited by client address
+RATE_LIMIT_API_KEYS = {k.strip() for k in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if k.strip()}
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", "200"))  # Queued upstream calls before 429s
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "30"))  # Seconds a call may wait for a slot
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+
+# Seconds to let queued jobs and in-flight extractions finish on shutdown, one deadline for both; serve.py
+# keeps the server's graceful timeout above it
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "25"))
+
+# Prompt settings
+PROMPT_MODE = os.getenv("PROMPT_MODE", "prose")  # prose (schema in the prompt) or json_schema (response_format)
+MAX_TOKENS_PER_FIELD = int(os.getenv("MAX_TOKENS_PER_FIELD", "32"))
+MAX_TOKENS_OVERHEAD = int(os.getenv("MAX_TOKENS_OVERHEAD", "64"))
+
+# card_type=auto settings
+CLASSIFIER_MODEL = os.getenv("CLASSIFIER_MODEL", "openai/gpt-4o-mini")
+CLASSIFIER_MAX_DIMENSION = int(os.getenv("CLASSIFIER_MAX_DIMENSION", "512"))
+AUTO_MAX_DOCUMENTS = int(os.getenv("AUTO_MAX_DOCUMENTS", "4"))
+AUTO_CROP_PADDING = float(os.getenv("AUTO_CROP_PADDING", "0.02"))  # Fraction of the image added around each box
+AUTO_FULL_FRAME_AREA = float(os.getenv("AUTO_FULL_FRAME_AREA", "0.8"))  # A single box this large is not cropped
+
+# Opt-in refinement pass: re-read invalid or low-confidence fields from crops of the original upload
+REFINE_CONFIDENCE_THRESHOLD = float(os.getenv("REFINE_CONFIDENCE_THRESHOLD", "0.7"))
+REFINE_MAX_FIELDS = int(os.getenv("REFINE_MAX_FIELDS", "6"))  # Crops sent in the follow-up call
+REFINE_CROP_PADDING = float(os.getenv("REFINE_CROP_PADDING", "0.01"))
+REFINE_CROP_MAX_DIMENSION = int(os.getenv("REFINE_CROP_MAX_DIMENSION", "768"))
+MAX_TOKENS_PER_LOCATION = int(os.getenv("MAX_TOKENS_PER_LOCATION", "32"))  # bbox + confidence per field
+
+COLD_START: Dict[str, float] = {}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    # Checked when the server starts rather than at import, so offline tools can import this module
+    if not OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY is not set. Please add it to Bk/api/.env or the deployment environment.")
+    # Shared state is created per worker process here, not at import
+    get_http_client()
+    result_cache.open()
+    rate_limiter.open()
+    await job_queue.start()
+    COLD_START["startup_seconds"] = round(time.perf_counter() - started, 4)
+    yield
+    # The server has stopped accepting requests; let in-flight work finish before tearing down
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_TIMEOUT
+    await job_queue.stop(SHUTDOWN_DRAIN_TIMEOUT)
+    await drain_extractions(max(0.0, deadline - time.monotonic()))
+    await close_http_client()
+    await result_cache.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# Shared pooled client; created lazily so it binds to the running event loop
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            base_url=OPENROUTER_BASE_URL,
+            timeout=httpx.Timeout(OPENROUTER_TIMEOUT, connect=OPENROUTER_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=OPENROUTER_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENROUTER_MAX_KEEPALIVE,
+            ),
+            headers={
+                "Authorization": f"Bearer {OPENAI_API_KEY}",
+                "HTTP-Referer": "https://smart-doc-five.vercel.app/",
+                "X-Title": "SmartDoc Extractor",
+            },
+        )
+    return _http_client
+
+class Priority(int, Enum):
+    interactive = 0
+    bulk = 1
+
+# Lane of the request being served; bulk endpoints and job workers set it to bulk
+_priority: contextvars.ContextVar = contextvars.ContextVar("priority", default=Priority.interactive)
+
+def too_many_requests(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+class AdmissionController:
+    """Global cap on concurrent upstream calls; waiting calls are admitted interactive-first"""
+
+    def __init__(self, capacity: int, max_waiting: int, max_wait: float):
+        self.capacity = capacity
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.active = 0
+        self.rejected = 0
+        self._waiters: List[tuple] = []  # heap of (priority, seq, future)
+        self._seq = 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    async def acquire(self, priority: Priority):
+        if self.active < self.capacity and not self._waiters:
+            self.active += 1
+            return
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            RATE_LIMITED.inc(reason="admission")
+            raise too_many_requests("Upstream capacity exhausted, retry later", ADMISSION_RETRY_AFTER)
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (int(priority), self._seq, future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                self.release()  # Granted just as we gave up; pass the slot on
+            else:
+                future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                RATE_LIMITED.inc(reason="admission_timeout")
+                raise too_many_requests("Timed out waiting for upstream capacity", ADMISSION_RETRY_AFTER)
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)  # Hand the slot over; active count is unchanged
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire(_priority.get())
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        lanes = {p.name: 0 for p in Priority}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                lanes[Priority(priority).name] += 1
+        return {"capacity": self.capacity, "active": self.active, "waiting": lanes, "rejected": self.rejected}
+
+admission = AdmissionController(OPENROUTER_MAX_CONCURRENCY, ADMISSION_MAX_WAITING, ADMISSION_MAX_WAIT)
+
+class TokenBucketLimiter:
+    """Per-client token buckets held in process memory"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, updated_at)
+
+    def open(self):
+        pass
+
+    async def acquire(self, key: str, cost: float = 1.0) -> Tuple[bool, float]:
+        return self.take(key, cost)
+
+    def take(self, key: str, cost: float = 1.0) -> Tuple[bool, float]:
+        """Returns (allowed, seconds until enough tokens are available)"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > 10000:
+            self._prune(now)
+        return allowed, 0.0 if allowed else (cost - tokens) / self.rate
+
+    def _prune(self, now: float):
+        # A bucket idle long enough to refill completely carries no state
+        full_after = self.burst / self.rate
+        for key in [k for k, (_, updated) in self._buckets.items() if now - updated > full_after]:
+            del self._buckets[key]
+
+class SQLiteTokenBucketLimiter(TokenBucketLimiter):
+    """Token buckets in a SQLite file so every worker on the host shares one limit per client"""
+
+    def __init__(self, rate: float, burst: float, db_path: str):
+        super().__init__(rate, burst)
+        self.db_path = db_path
+        self._db = None
+        self._lock = threading.Lock()  # One transaction at a time on the shared connection
+
+    def open(self):
+        if self._db is not None:
+            return
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=1)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    async def acquire(self, key: str, cost: float = 1.0) -> Tuple[bool, float]:
+        # Off the event loop: BEGIN IMMEDIATE can block for the busy timeout while another worker writes
+        try:
+            return await asyncio.to_thread(self.take, key, cost)
+        except sqlite3.OperationalError:
+            RATE_LIMIT_ERRORS.inc()
+            return True, 0.0  # Fail open; a locked limiter should not turn into 500s
+
+    def take(self, key: str, cost: float = 1.0) -> Tuple[bool, float]:
+        with self._lock:
+            return self._take(key, cost)
+
+    def _take(self, key: str, cost: float) -> Tuple[bool, float]:
+        self.open()
+        now = time.time()  # Wall clock, since monotonic clocks differ between processes
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (self.burst, now)
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._db.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        return allowed, 0.0 if allowed else (cost - tokens) / self.rate
+
+rate_limiter = (
+    SQLiteTokenBucketLimiter(RATE_LIMIT_RPS, RATE_LIMIT_BURST, RATE_LIMIT_DB)
+    if RATE_LIMIT_DB else TokenBucketLimiter(RATE_LIMIT_RPS, RATE_LIMIT_BURST)
+)
+
+def trusted_api_key(request: Request) -> Optional[str]:
+    """The caller's X-API-Key if it is one of RATE_LIMIT_API_KEYS; unknown keys are ignored"""
+    key = request.headers.get("x-api-key")
+    return key if key and key in RATE_LIMIT_API_KEYS else None
+
+def client_key(request: Request) -> str:
+    """Identify the caller by a configured API key, otherwise by client address"""
+    key = trusted_api_key(request)
+    identity = f"key:{key}" if key else f"ip:{request.client.host if request.client else 'unknown'}"
+    return hashlib.sha256(identity.encode()).hexdigest()[:32]
+
+async def check_rate_limit(request: Request, cost: float = 1.0):
+    if not RATE_LIMIT_ENABLED or cost <= 0:
+        return
+    allowed, retry_after = await rate_limiter.acquire(client_key(request), cost)
+    if not allowed:
+        RATE_LIMITED.inc(reason="client")
+        raise too_many_requests("Rate limit exceeded for this client", retry_after)
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_str(labelnames, key, extra: str = "") -> str:
+    pairs = [f'{name}="{_label_value(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1.0, **labels):
+        self._values[tuple(labels[n] for n in self.labelnames)] += amount
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value}")
+        return lines
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time"""
+
+    def __init__(self, name: str, help: str, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def collect(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {float(self.fn())}"]
+
+class CounterFunc(Gauge):
+    """Counter whose monotonically increasing value is read from a callback at scrape time"""
+
+    def collect(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter", f"{self.name} {float(self.fn())}"]
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in self._series.items():
+            for bound, count in zip(self.buckets, series):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, le)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {series[-1]}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+HTTP_REQUEST_SECONDS = metrics.register(Histogram(
+    "smartdoc_http_request_duration_seconds", "HTTP request latency", ("method", "route", "status")))
+STAGE_SECONDS = metrics.register(Histogram(
+    "smartdoc_stage_duration_seconds", "Latency of each extraction stage", ("stage", "card_type", "model")))
+UPSTREAM_RESPONSES = metrics.register(Counter(
+    "smartdoc_upstream_responses_total", "Upstream responses by status code", ("model", "status")))
+UPSTREAM_TOKENS = metrics.register(Counter(
+    "smartdoc_upstream_tokens_total", "Tokens reported in the upstream usage block", ("model", "kind")))
+PAYLOAD_BYTES = metrics.register(Counter(
+    "smartdoc_payload_bytes_total", "Image bytes received from clients and sent upstream", ("direction", "card_type")))
+CARD_TOKENS = metrics.register(Counter(
+    "smartdoc_card_tokens_total", "Tokens per card type and prompt mode", ("card_type", "kind", "prompt_mode")))
+PARSE_OUTCOMES = metrics.register(Counter(
+    "smartdoc_parse_outcomes_total", "Model output parses: clean, extracted from prose, repaired, truncated or failed",
+    ("outcome",)))
+RATE_LIMITED = metrics.register(Counter(
+    "smartdoc_rate_limited_total", "Requests rejected by rate limiting or admission control", ("reason",)))
+RATE_LIMIT_ERRORS = metrics.register(Counter(
+    "smartdoc_rate_limit_errors_total", "Rate limiter store errors (requests let through)", ()))
+JOB_ERRORS = metrics.register(Counter(
+    "smartdoc_job_errors_total", "Background jobs that failed outside the extraction (job store errors)", ()))
+VALIDATION_RESULTS = metrics.register(Counter(
+    "smartdoc_validation_results_total", "Field validation outcomes", ("card_type", "field", "result")))
+REFINEMENTS = metrics.register(Counter(
+    "smartdoc_refinements_total", "Refinement passes by outcome", ("card_type", "outcome")))
+REFINE_ROUND_TRIPS = metrics.register(Counter(
+    "smartdoc_refine_round_trips_total", "Follow-up upstream calls made by the refinement pass", ("card_type",)))
+REFINED_FIELDS = metrics.register(Counter(
+    "smartdoc_refined_fields_total", "Fields re-read by the refinement pass", ("card_type", "field", "result")))
+
+# Model that served the current extraction, so later stages can be labeled with it
+_served_model: contextvars.ContextVar = contextvars.ContextVar("served_model", default=None)
+
+def stage_timer(stage: str, card_type):
+    model = _served_model.get() or OPENROUTER_MODEL
+    return STAGE_SECONDS.time(stage=stage, card_type=card_type.value, model=model)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=str(status),
+        )
+
+RATE_LIMITED_PATHS = {"/extract-info", "/extract-info/stream", "/extract-info/upload", "/extract-info/raw", "/extract-batch", "/jobs"}
+BULK_PATHS = {"/extract-batch", "/jobs"}
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """Reject over-limit clients before the body is read, and pick the request's priority lane"""
+    path = request.url.path
+    if request.method == "POST" and path in RATE_LIMITED_PATHS:
+        try:
+            await check_rate_limit(request)
+        except HTTPException as e:
+            return JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+        # Only trusted callers may choose a lane, or anyone could jump ahead of the UI with bulk work
+        lane = request.headers.get("x-priority") if trusted_api_key(request) else None
+        if lane in Priority.__members__:
+            _priority.set(Priority[lane])
+        elif path in BULK_PATHS:
+            _priority.set(Priority.bulk)
+    return await call_next(request)
 
 # Your existing model classes remain the same...
 class CardType(str, Enum):
     driving_license = "driving_license"
     pan_card = "pan_card"
     aadhaar_card = "aadhaar_card"
+    auto = "auto"  # Classify (and split) the image first, then extract each document
 
 class ImageData(BaseModel):
     image_data: str
@@ -45,17 +566,21 @@ class Address(BaseModel):
     state: Optional[str] = None
     zipCode: Optional[str] = None
 
+# Value hints the prose prompts spell out, carried into the json_schema response format
+def date_field():
+    return Field(None, description="Date as DD/MM/YYYY")
+
 class DrivingLicense(BaseModel):
     state: Optional[str] = None
     dlNumber: Optional[str] = None
-    issueDate: Optional[str] = None
-    expiryDate: Optional[str] = None
+    issueDate: Optional[str] = date_field()
+    expiryDate: Optional[str] = date_field()
     name: Optional[Name] = None
     address: Optional[Address] = None
-    sex: Optional[str] = None
+    sex: Optional[str] = Field(None, enum=["M", "F"])
     height: Optional[str] = None
     weight: Optional[str] = None
-    dateOfBirth: Optional[str] = None
+    dateOfBirth: Optional[str] = date_field()
     restrictions: Optional[List[str]] = None
     hairColor: Optional[str] = None
     eyeColor: Optional[str] = None
@@ -71,8 +596,8 @@ class PanCard(BaseModel):
     panNumber: Optional[str] = None
     name: Optional[PanName] = None
     fatherName: Optional[str] = None
-    dateOfBirth: Optional[str] = None
-    issueDate: Optional[str] = None
+    dateOfBirth: Optional[str] = date_field()
+    issueDate: Optional[str] = date_field()
 
 class AadhaarAddress(BaseModel):
     house: Optional[str] = None
@@ -85,8 +610,8 @@ class AadhaarAddress(BaseModel):
 class AadhaarCard(BaseModel):
     aadhaarNumber: Optional[str] = None
     name: Optional[str] = None
-    dateOfBirth: Optional[str] = None
-    gender: Optional[str] = None
+    dateOfBirth: Optional[str] = date_field()
+    gender: Optional[str] = Field(None, enum=["M", "F", "Other"])
     address: Optional[AadhaarAddress] = None
 
 class ExtractedData(BaseModel):
@@ -98,8 +623,35 @@ class APIResponse(BaseModel):
     success: bool
     data: Optional[ExtractedData] = None
     validation: Optional[dict] = None  # New field for validation results
+    preprocessing: Optional[dict] = None  # Image normalization report
+    refinement: Optional[dict] = None  # Field locations and re-read fields when refine=true
+    truncated: Optional[bool] = None  # The model hit max_tokens; fields after the cut are missing
     error: Optional[str] = None
 
+class BatchRequest(BaseModel):
+    items: List[ImageData]
+
+class BatchResponse(BaseModel):
+    results: List[APIResponse]
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+class JobRequest(ImageData):
+    callback_url: Optional[str] = None
+    refine: bool = False
+
+class JobInfo(BaseModel):
+    id: str
+    status: JobStatus
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[APIResponse] = None
+
 # FIXED CORS configuration
 origins = [
     "https://smart-doc-five.vercel.app",
@@ -220,124 +772,821 @@ def get_openai_prompt(card_type: CardType) -> str:
     else:
         raise ValueError("Invalid card type")
 
+CARD_KEYS = {
+    CardType.driving_license: "drivingLicense",
+    CardType.pan_card: "panCard",
+    CardType.aadhaar_card: "aadhaarCard",
+}
+
+CARD_MODELS: Dict[CardType, Type[BaseModel]] = {
+    CardType.driving_license: DrivingLicense,
+    CardType.pan_card: PanCard,
+    CardType.aadhaar_card: AadhaarCard,
+}
+
+def model_json_schema(model: Type[BaseModel]) -> dict:
+    """Strict structured-output schema: every field required and nullable, no extra keys, with the
+    fields' allowed values and descriptions"""
+    properties = {}
+    for name, field in model.__fields__.items():
+        if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+            properties[name] = {"anyOf": [model_json_schema(field.type_), {"type": "null"}]}
+        elif field.outer_type_ is not field.type_:  # List[str]
+            properties[name] = {"type": ["array", "null"], "items": {"type": "string"}}
+        else:
+            properties[name] = {"type": ["string", "null"]}
+            if field.field_info.extra.get("enum"):
+                properties[name]["enum"] = field.field_info.extra["enum"] + [None]
+        if field.field_info.description:
+            properties[name]["description"] = field.field_info.description
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+def count_leaf_fields(model: Type[BaseModel]) -> int:
+    return sum(
+        count_leaf_fields(f.type_) if isinstance(f.type_, type) and issubclass(f.type_, BaseModel) else 1
+        for f in model.__fields__.values()
+    )
+
+def scalar_field_paths(model: Type[BaseModel], prefix: str = "") -> List[str]:
+    """Dotted paths of the single-value fields a model can be asked to locate"""
+    paths = []
+    for name, field in model.__fields__.items():
+        if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+            paths.extend(scalar_field_paths(field.type_, f"{prefix}{name}."))
+        elif field.outer_type_ is field.type_:
+            paths.append(prefix + name)
+    return paths
+
+LOCATABLE_FIELDS: Dict[CardType, List[str]] = {card_type: scalar_field_paths(model) for card_type, model in CARD_MODELS.items()}
+
+LOCATE_INSTRUCTIONS = (
+    'Also return "_fields": one entry per non-null field, {"path": dotted field path such as name.firstName, '
+    '"bbox": [x_min, y_min, x_max, y_max] as fractions (0 to 1) of the image width and height, '
+    '"confidence": 0 to 1 for how sure you are of the value}.'
+)
+
+CARD_DOCUMENTS = {
+    CardType.driving_license: "a driving license",
+    CardType.pan_card: "a PAN card",
+    CardType.aadhaar_card: "an Aadhaar card",
+}
+
+# The schema carries the structure, allowed values and date format, so json_schema mode needs only these
+JSON_SCHEMA_PROMPT = (
+    "You are an AI system specialized in document information extraction.\n"
+    "You will receive {document} image. Extract every visible field into the provided JSON schema."
+)
+JSON_SCHEMA_RULES = [
+    '- If a field is missing, unreadable, or not applicable, return null (not "Not detected").',
+    "- For list fields, return an empty list [] if none are visible.",
+    "- Follow each field's description and allowed values.",
+    "- Preserve leading zeros in numbers and dates.",
+    "- Do not hallucinate values. If unsure, use null.",
+]
+
+def compact_prompt(prompt: str) -> str:
+    """Drop the indentation and blank lines that the prompt literals carry; they cost tokens on every call"""
+    return "\n".join(line.strip() for line in prompt.strip().splitlines() if line.strip())
+
+def build_prompt_config(card_type: CardType, mode: str, locate: bool = False) -> Dict[str, Any]:
+    """locate=True also asks for a bbox and confidence per field, for the refinement pass"""
+    leaf_fields = count_leaf_fields(CARD_MODELS[card_type])
+    config = {
+        # Output is roughly one short value per leaf field, plus JSON punctuation
+        "max_tokens": MAX_TOKENS_OVERHEAD + MAX_TOKENS_PER_FIELD * leaf_fields
+        + (MAX_TOKENS_PER_LOCATION * leaf_fields if locate else 0),
+        "response_format": None,
+    }
+    if mode == "json_schema":
+        config["system"] = "\n".join(
+            [JSON_SCHEMA_PROMPT.format(document=CARD_DOCUMENTS[card_type])] + JSON_SCHEMA_RULES
+            + ([LOCATE_INSTRUCTIONS] if locate else [])
+        )
+        properties = {CARD_KEYS[card_type]: model_json_schema(CARD_MODELS[card_type])}
+        if locate:
+            properties["_fields"] = {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "path": {"type": "string", "enum": LOCATABLE_FIELDS[card_type]},
+                        "bbox": {"type": "array", "items": {"type": "number"}},
+                        "confidence": {"type": "number"},
+                    },
+                    "required": ["path", "bbox", "confidence"],
+                    "additionalProperties": False,
+                },
+            }
+        config["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": CARD_KEYS[card_type],
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": properties,
+                    "required": list(properties),
+                    "additionalProperties": False,
+                },
+            },
+        }
+    else:
+        config["system"] = "\n".join(
+            [compact_prompt(get_openai_prompt(card_type))] + ([LOCATE_INSTRUCTIONS] if locate else [])
+            + ["Return only valid JSON as response. Do not include any explanations or markdown formatting."]
+        )
+    return config
+
+# Built once at startup instead of on every request
+PROMPTS: Dict[CardType, Dict[str, Any]] = {card_type: build_prompt_config(card_type, PROMPT_MODE) for card_type in CARD_KEYS}
+LOCATE_PROMPTS: Dict[CardType, Dict[str, Any]] = {
+    card_type: build_prompt_config(card_type, PROMPT_MODE, locate=True) for card_type in CARD_KEYS
+}
+
+# Values models use to say "nothing here" instead of null
+NULL_SENTINELS = {"", "null", "none", "n/a", "na", "not detected", "not available", "not visible", "unknown", "-"}
+
+def _is_model(tp) -> bool:
+    return isinstance(tp, type) and issubclass(tp, BaseModel)
+
+def _clean_scalar(value):
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        value = str(value)
+    return None if value.strip().lower() in NULL_SENTINELS else value
+
+def coerce_field(field, value):
+    if _is_model(field.type_):
+        return coerce_model_fields(field.type_, value) if isinstance(value, dict) else None
+    if field.outer_type_ is not field.type_:  # List[str]
+        if not isinstance(value, list):
+            value = [] if _clean_scalar(value) is None else [value]
+        return [v for v in map(_clean_scalar, value) if v is not None]
+    return _clean_scalar(value)
+
+def coerce_model_fields(model: Type[BaseModel], values: dict) -> dict:
+    """Coerce one card (or nested object) to the field types its Pydantic model expects"""
+    for name, field in model.__fields__.items():
+        if name in values:
+            values[name] = coerce_field(field, values[name])
+    return values
+
 def coerce_types(data):
-    dl = data.get("drivingLicense", {})
-    # String fields
-    for field in [
-        "state", "dlNumber", "issueDate", "expiryDate", "sex", "height", "weight", "dateOfBirth", "hairColor", "eyeColor", "dd"
-    ]:
-        if field in dl and dl[field] is not None and not isinstance(dl[field], str):
-            dl[field] = str(dl[field])
-    # Name fields
-    if "name" in dl and isinstance(dl["name"], dict):
-        for nfield in ["firstName", "middleName", "lastName"]:
-            if nfield in dl["name"] and dl["name"][nfield] is not None and not isinstance(dl["name"][nfield], str):
-                dl["name"][nfield] = str(dl["name"][nfield])
-    # Address fields
-    if "address" in dl and isinstance(dl["address"], dict):
-        for afield in ["street", "city", "state", "zipCode"]:
-            if afield in dl["address"] and dl["address"][afield] is not None and not isinstance(dl["address"][afield], str):
-                dl["address"][afield] = str(dl["address"][afield])
-    # List fields
-    for lfield in ["restrictions", "endorsements"]:
-        if lfield in dl and not isinstance(dl[lfield], list):
-            dl[lfield] = []
-    data["drivingLicense"] = dl
+    for card_type, card_key in CARD_KEYS.items():
+        if card_key in data:
+            card = data[card_key]
+            data[card_key] = coerce_model_fields(CARD_MODELS[card_type], card) if isinstance(card, dict) else {}
     return data
 
-def extract_info_with_openrouter(image_data: str, mime_type: str, card_type: CardType) -> Dict[str, Any]:
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+class UpstreamError(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[float] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code in RETRYABLE_STATUS_CODES
+
+def upstream_error_status(code) -> int:
+    """HTTP status for an error body's code, which OpenRouter may also send as a string (e.g. rate_limited)"""
     try:
-        prompt = get_openai_prompt(card_type)
-        system_prompt = prompt + "\nReturn only valid JSON as response. Do not include any explanations or markdown formatting."
+        status = int(code)
+    except (TypeError, ValueError):
+        return 502
+    return status if 400 <= status < 600 else 502
 
-        # Format image for vision API (OpenAI/OpenRouter vision format)
-        image_url = f"data:{mime_type};base64,{image_data}"
-        
-        payload = {
-            "model": "openai/gpt-4o-mini",  # Vision-capable model
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Extract all information from this document image and return it as JSON following the schema provided."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_url
-                            }
-                        }
-                    ]
-                }
-            ],
-            "temperature": 0.2,
-            "max_tokens": 2048
-        }
+class CircuitBreaker:
+    """Opens after consecutive failures; lets one trial call through after the reset timeout"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def release_trial(self):
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+class RetryBudget:
+    """Caps retries to a fraction of recent request volume so retries cannot amplify an outage"""
+
+    def __init__(self, ratio: float, minimum: float):
+        self.ratio = ratio
+        self.maximum = max(minimum, 100.0)
+        self.tokens = minimum
+
+    def deposit(self):
+        self.tokens = min(self.maximum, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class ModelStats:
+    def __init__(self, model: str, window: int = 200):
+        self.model = model
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.hedges = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.latencies: "deque[float]" = deque(maxlen=window)
 
-        headers = {
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "HTTP-Referer": "https://smart-doc-five.vercel.app/",
-            "X-Title": "SmartDoc Extractor",
-            "Content-Type": "application/json"
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def record_usage(self, usage: Optional[dict]):
+        if not usage:
+            return
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        UPSTREAM_TOKENS.inc(prompt_tokens, model=self.model, kind="prompt")
+        UPSTREAM_TOKENS.inc(completion_tokens, model=self.model, kind="completion")
+        self.cost += usage.get("cost") or 0.0
+
+    def as_dict(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "requests": self.requests,
+            "successes": self.successes,
+            "failures": self.failures,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "latency_p50_s": round(p50, 4) if p50 is not None else None,
+            "latency_p95_s": round(p95, 4) if p95 is not None else None,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost": round(self.cost, 6),
         }
 
-        res = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            json=payload,
-            headers=headers,
-            timeout=60
-        )
+class UpstreamRouter:
+    """Retries with jittered backoff, per-model circuit breakers, ordered fallback and optional hedging"""
 
-        if res.status_code != 200:
-            raise HTTPException(status_code=res.status_code, detail=f"OpenRouter API error: {res.text}")
+    def __init__(self, models: List[str]):
+        self.models = models
+        self.breakers = {m: CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT) for m in models}
+        self.stats = {m: ModelStats(m) for m in models}
+        self.budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN)
 
+    def available_models(self) -> List[str]:
+        return [m for m in self.models if self.breakers[m].state != "open"]
+
+    def hedge_delay(self, model: str) -> float:
+        if HEDGE_DELAY:
+            return float(HEDGE_DELAY)
+        stats = self.stats[model]
+        if len(stats.latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return stats.percentile(0.95)
+
+    async def _attempt(self, model: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        stats = self.stats[model]
+        stats.requests += 1
+        started = time.monotonic()
+        try:
+            async with admission.slot():
+                res = await get_http_client().post("/chat/completions", json={**payload, "model": model, **USAGE_PARAMS})
+        except httpx.TimeoutException as e:
+            UPSTREAM_RESPONSES.inc(model=model, status="timeout")
+            raise UpstreamError(504, f"OpenRouter request timed out: {str(e)}")
+        except httpx.HTTPError as e:
+            UPSTREAM_RESPONSES.inc(model=model, status="error")
+            raise UpstreamError(502, f"Request error: {str(e)}")
+        UPSTREAM_RESPONSES.inc(model=model, status=str(res.status_code))
+        if res.status_code != 200:
+            retry_after = res.headers.get("Retry-After")
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None  # HTTP-date form; fall back to our own backoff
+            raise UpstreamError(res.status_code, f"OpenRouter API error: {res.text}", retry_after)
         response_data = res.json()
-        response_text = response_data["choices"][0]["message"]["content"].strip()
+        if response_data.get("error"):
+            # OpenRouter can report provider failures inside a 200 body
+            error = response_data["error"]
+            raise UpstreamError(upstream_error_status(error.get("code")), f"OpenRouter API error: {error.get('message', error)}")
+        stats.latencies.append(time.monotonic() - started)
+        stats.record_usage(response_data.get("usage"))
+        return response_data
+
+    async def _call_model(self, model: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        breaker = self.breakers[model]
+        stats = self.stats[model]
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise UpstreamError(503, f"Circuit open for {model}")
+            try:
+                response_data = await self._attempt(model, payload)
+            except UpstreamError as e:
+                stats.failures += 1
+                if not e.retryable:
+                    # The model answered; a bad request is not a verdict on its health
+                    breaker.release_trial()
+                    raise
+                breaker.record_failure()
+                attempt += 1
+                if attempt >= RETRY_MAX_ATTEMPTS:
+                    raise
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+                if e.retry_after is not None:
+                    if e.retry_after > RETRY_MAX_DELAY:
+                        raise  # Let the next model take it rather than wait
+                    delay = max(delay, e.retry_after)
+                if not self.budget.withdraw():
+                    raise
+                stats.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Lost a hedge race, or failed locally (admission 429, bad body); free the half-open trial
+                breaker.release_trial()
+                raise
+            breaker.record_success()
+            stats.successes += 1
+            return response_data
+
+    async def call(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        models = self.available_models()
+        if not models:
+            raise UpstreamError(503, "All upstream models are unavailable (circuits open)")
+        self.budget.deposit()
+        pending: Dict[asyncio.Task, str] = {}
+        remaining = list(models)
+        last_error: Optional[UpstreamError] = None
+
+        def launch():
+            model = remaining.pop(0)
+            pending[asyncio.ensure_future(self._call_model(model, payload))] = model
+            return model
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if HEDGE_ENABLED and remaining and len(pending) == 1:
+                    timeout = self.hedge_delay(next(iter(pending.values())))
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.stats[launch()].hedges += 1
+                    continue
+                for task in done:
+                    failed = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+                    if not isinstance(error, UpstreamError) or not error.retryable:
+                        raise error  # Another model would reject the same request
+                    last_error = error
+                # Failing over is a retry too and draws on the budget, unless the model's circuit is open
+                if not pending and remaining and (self.breakers[failed].state == "open" or self.budget.withdraw()):
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise last_error
+
+    def as_dict(self) -> dict:
+        return {
+            "retry_budget": round(self.budget.tokens, 2),
+            "models": {
+                m: {**self.stats[m].as_dict(), "circuit": self.breakers[m].state} for m in self.models
+            },
+        }
+
+upstream = UpstreamRouter([OPENROUTER_MODEL] + [m for m in OPENROUTER_FALLBACK_MODELS if m != OPENROUTER_MODEL])
+
+def build_openrouter_payload(image_bytes: bytes, mime_type: str, card_type: CardType, locate: bool = False) -> Dict[str, Any]:
+    with stage_timer("prompt", card_type):
+        prompt = (LOCATE_PROMPTS if locate else PROMPTS)[card_type]
+
+        # Format image for vision API (OpenAI/OpenRouter vision format); the only base64 encode
+        image_url = f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode()}"
+    PAYLOAD_BYTES.inc(len(image_bytes), direction="upstream", card_type=card_type.value)
+
+    payload = {
+        "model": upstream.models[0],
+        "messages": [
+            {"role": "system", "content": prompt["system"]},
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "Extract all information from this document image and return it as JSON following the schema provided."
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_url
+                        }
+                    }
+                ]
+            }
+        ],
+        "temperature": 0.2,
+        "max_tokens": prompt["max_tokens"]
+    }
+    if prompt["response_format"]:
+        payload["response_format"] = prompt["response_format"]
+    return payload
+
+def _json_loads(text: str):
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+_BAREWORDS = {"None": "null", "True": "true", "False": "false", "NULL": "null", "Null": "null"}
+
+def repair_json(text: str) -> str:
+    """Best-effort rewrite of the outermost object in model output into valid JSON.
+
+    Skips prose or fences around the object, converts single-quoted strings and Python
+    literals, drops trailing commas, and closes anything left open by a truncated reply.
+    """
+    start = text.find("{")
+    if start < 0:
+        raise json.JSONDecodeError("No JSON object found in model output", text, 0)
+    out: List[str] = []
+    stack: List[str] = []
+    i = start
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c in "\"'":
+            # Copy a string, normalizing it to double quotes
+            quote = c
+            j = i + 1
+            chunk = ['"']
+            while j < n and text[j] != quote:
+                if text[j] == "\\" and j + 1 < n:
+                    nxt = text[j + 1]
+                    chunk.append(nxt if nxt == "'" else text[j:j + 2])
+                    j += 2
+                    continue
+                if text[j] == '"':
+                    chunk.append('\\"')
+                elif text[j] == "\n":
+                    chunk.append("\\n")
+                else:
+                    chunk.append(text[j])
+                j += 1
+            chunk.append('"')
+            out.append("".join(chunk))
+            i = j + 1
+            continue
+        if c in "{[":
+            stack.append("}" if c == "{" else "]")
+            out.append(c)
+        elif c in "}]":
+            # Drop a trailing comma before the closer
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if stack:
+                out.append(stack.pop())
+            if not stack:
+                break
+        elif c.isalpha() or c == "_":
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            out.append(_BAREWORDS.get(word, word))
+            i = j
+            continue
+        else:
+            out.append(c)
+        i += 1
+    if stack:
+        # Truncated reply: finish a dangling key or value, then close what is open
+        tail = "".join(out).rstrip()
+        if tail.endswith(","):
+            tail = tail[:-1]
+        if tail.endswith(":"):
+            tail += " null"
+        elif stack[-1] == "}" and re.search(r'[{,]\s*"(?:[^"\\]|\\.)*"$', tail):
+            tail += ": null"
+        out = [tail] + stack[::-1]
+    return "".join(out)
+
+def reply_truncated(response_data: Dict[str, Any]) -> bool:
+    return response_data["choices"][0].get("finish_reason") == "length"
 
-        if response_text.startswith('```json'):
-            response_text = response_text[7:-3]
-        elif response_text.startswith('```'):
-            response_text = response_text[3:-3]
+def parse_model_output(
+    response_text: str, card_type: Optional[CardType] = None, truncated: bool = False
+) -> Dict[str, Any]:
+    """truncated: the reply stopped at max_tokens, so a repaired object is counted as truncated, not repaired"""
+    text = response_text.strip()
+    start, end = text.find("{"), text.rfind("}")
+    try:
+        if start < 0 or end < start:
+            raise json.JSONDecodeError("No JSON object found in model output", text, 0)
+        extracted_data = _json_loads(text[start:end + 1])
+        outcome = "clean" if start == 0 and end == len(text) - 1 else "extracted"
+    except ValueError:
+        try:
+            extracted_data = _json_loads(repair_json(text))
+        except ValueError:
+            PARSE_OUTCOMES.inc(outcome="failed")
+            raise
+        outcome = "repaired"
+    PARSE_OUTCOMES.inc(outcome="truncated" if truncated else outcome)
+    if not isinstance(extracted_data, dict):
+        PARSE_OUTCOMES.inc(outcome="failed")
+        raise json.JSONDecodeError("Model output is not a JSON object", text, 0)
+    if card_type is not None:
+        card_key = CARD_KEYS[card_type]
+        # Models sometimes drop the top-level card wrapper
+        if card_key not in extracted_data and set(extracted_data) & set(CARD_MODELS[card_type].__fields__):
+            extracted_data = {card_key: extracted_data}
+    return coerce_types(extracted_data)
 
-        extracted_data = json.loads(response_text)
-        extracted_data = coerce_types(extracted_data)
-        return extracted_data
+def record_card_usage(card_type: CardType, usage: Optional[dict]):
+    if not usage:
+        return
+    for kind in ("prompt", "completion"):
+        CARD_TOKENS.inc(usage.get(f"{kind}_tokens") or 0, card_type=card_type.value, kind=kind, prompt_mode=PROMPT_MODE)
+
+async def extract_info_with_openrouter(
+    image_bytes: bytes, mime_type: str, card_type: CardType, locate: bool = False
+) -> Tuple[Dict[str, Any], bool]:
+    """Returns the parsed reply and whether the model stopped at max_tokens"""
+    try:
+        payload = build_openrouter_payload(image_bytes, mime_type, card_type, locate)
+        started = time.perf_counter()
+        response_data = await upstream.call(payload)
+        _served_model.set(response_data.get("model") or payload["model"])
+        record_card_usage(card_type, response_data.get("usage"))
+        STAGE_SECONDS.observe(
+            time.perf_counter() - started, stage="upstream", card_type=card_type.value, model=_served_model.get()
+        )
+        truncated = reply_truncated(response_data)
+        with stage_timer("parse", card_type):
+            return parse_model_output(response_data["choices"][0]["message"]["content"], card_type, truncated), truncated
 
     except json.JSONDecodeError as e:
         raise HTTPException(status_code=422, detail=f"Failed to parse OpenRouter response as JSON: {str(e)}")
-    except requests.RequestException as e:
-        raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OpenRouter API error: {str(e)}")
 
+async def stream_openrouter_text(image_bytes: bytes, mime_type: str, card_type: CardType, finish: Optional[dict] = None):
+    """Yield content deltas from a streaming chat completion; finish["reason"] receives the finish_reason"""
+    payload = build_openrouter_payload(image_bytes, mime_type, card_type)
+    payload["stream"] = True
+    payload.update(USAGE_PARAMS)
+    model = next((m for m in upstream.models if upstream.breakers[m].allow()), None)
+    if model is None:
+        raise HTTPException(status_code=503, detail="All upstream models are unavailable (circuits open)")
+    payload["model"] = model
+    _served_model.set(model)
+    breaker, stats = upstream.breakers[model], upstream.stats[model]
+    stats.requests += 1
+    started = time.monotonic()
+    try:
+        async with admission.slot():
+            async with get_http_client().stream("POST", "/chat/completions", json=payload) as res:
+                UPSTREAM_RESPONSES.inc(model=model, status=str(res.status_code))
+                if res.status_code != 200:
+                    body = (await res.aread()).decode(errors="replace")
+                    raise UpstreamError(res.status_code, f"OpenRouter API error: {body}")
+                async for line in res.aiter_lines():
+                    if line.startswith("data:") and '"usage"' in line:
+                        usage = json.loads(line[5:]).get("usage")
+                        stats.record_usage(usage)
+                        record_card_usage(card_type, usage)
+                    # Ignore blank lines and ": keep-alive" comments
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    if chunk.get("error"):
+                        error = chunk["error"]
+                        raise UpstreamError(upstream_error_status(error.get("code")), f"OpenRouter API error: {error}")
+                    if not chunk.get("choices"):
+                        continue
+                    if finish is not None and chunk["choices"][0].get("finish_reason"):
+                        finish["reason"] = chunk["choices"][0]["finish_reason"]
+                    delta = chunk["choices"][0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+    except UpstreamError as e:
+        stats.failures += 1
+        if e.retryable:
+            breaker.record_failure()
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except httpx.HTTPError as e:
+        breaker.record_failure()
+        stats.failures += 1
+        if isinstance(e, httpx.TimeoutException):
+            raise HTTPException(status_code=504, detail=f"OpenRouter request timed out: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
+    finally:
+        # No-op once a verdict is recorded; frees the trial when the client abandons the stream
+        # or the call fails locally (admission 429, malformed chunk)
+        breaker.release_trial()
+    breaker.record_success()
+    stats.successes += 1
+    stats.latencies.append(time.monotonic() - started)
+    STAGE_SECONDS.observe(time.monotonic() - started, stage="upstream", card_type=card_type.value, model=model)
+
+class FieldStreamParser:
+    """Incrementally scans partial model JSON and reports each leaf field once its value is complete"""
+
+    _LITERAL = re.compile(r"-?[0-9][0-9.eE+-]*|true|false|null")
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._started = False
+        self._stack: List[dict] = []  # One entry per open object, holding the key being filled
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        self._buf += text
+        fields = []
+        buf = self._buf
+        while self._pos < len(buf):
+            c = buf[self._pos]
+            if not self._started:
+                # Skip markdown fences or prose before the root object
+                if c == "{":
+                    self._started = True
+                    continue
+                self._pos += 1
+                continue
+            if not self._stack and c != "{":
+                break  # Root object closed; ignore trailing text
+            if c in " \t\r\n,:":
+                self._pos += 1
+            elif c == "{":
+                self._stack.append({"key": None})
+                self._pos += 1
+            elif c == "}":
+                self._stack.pop()
+                if self._stack:
+                    self._stack[-1]["key"] = None
+                self._pos += 1
+            elif c == '"':
+                end = self._string_end(self._pos)
+                if end < 0:
+                    break
+                token = json.loads(buf[self._pos:end])
+                self._pos = end
+                if self._stack[-1]["key"] is None:
+                    self._stack[-1]["key"] = token
+                else:
+                    fields.append(self._emit(token))
+            elif c == "[":
+                end = self._array_end(self._pos)
+                if end < 0:
+                    break
+                value = json.loads(buf[self._pos:end])
+                self._pos = end
+                fields.append(self._emit(value))
+            else:
+                match = self._LITERAL.match(buf, self._pos)
+                if not match or match.end() >= len(buf):
+                    break  # Need more input to know the literal is complete
+                self._pos = match.end()
+                fields.append(self._emit(json.loads(match.group())))
+        return fields
+
+    def _emit(self, value) -> Tuple[str, Any]:
+        path = ".".join(entry["key"] for entry in self._stack if entry["key"] is not None)
+        self._stack[-1]["key"] = None
+        return path, value
+
+    def _string_end(self, start: int) -> int:
+        i = start + 1
+        while i < len(self._buf):
+            c = self._buf[i]
+            if c == "\\":
+                i += 2
+                continue
+            if c == '"':
+                return i + 1
+            i += 1
+        return -1
+
+    def _array_end(self, start: int) -> int:
+        depth = 0
+        i = start
+        while i < len(self._buf):
+            c = self._buf[i]
+            if c == '"':
+                i = self._string_end(i)
+                if i < 0:
+                    return -1
+                continue
+            if c in "[{":
+                depth += 1
+            elif c in "]}":
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+            i += 1
+        return -1
+
+DL_NUMBER_RE = re.compile(r"[A-Z]{2}[0-9]{2} ?[0-9]{11}")
+PAN_NUMBER_RE = re.compile(r"[A-Z]{5}[0-9]{4}[A-Z]{1}")
+AADHAAR_NUMBER_RE = re.compile(r"^[2-9]{1}[0-9]{3} ?[0-9]{4} ?[0-9]{4}$")
+
+# Accepted date layouts, in the order they are tried: DD/MM/YYYY, DD-MM-YYYY, DD.MM.YYYY, YYYY-MM-DD, MM/DD/YYYY
+# Same digits as strptime: day and month are ASCII only, and %d also takes a space-padded digit (" 5"),
+# while %Y is \d{4} there and so accepts any Unicode digits
+DAY_FIRST_DATE_RE = re.compile(r"([0-9]{1,2}| [1-9])([/.-])([0-9]{1,2}| [1-9])\2(\d{4})")
+ISO_DATE_RE = re.compile(r"(\d{4})-([0-9]{1,2})-([0-9]{1,2}| [1-9])")
+DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+def _is_valid_date(year, month, day):
+    if year < 1 or not 1 <= month <= 12 or day < 1:
+        return False
+    if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        return day <= 29
+    return day <= DAYS_IN_MONTH[month - 1]
+
 def validate_dl_number(dl_number):
     if not dl_number:
         return None
-    return bool(re.fullmatch(r"[A-Z]{2}[0-9]{2} ?[0-9]{11}", dl_number))
+    return bool(DL_NUMBER_RE.fullmatch(dl_number))
 
 def validate_pan_number(pan_number):
     if not pan_number:
         return None
-    return bool(re.fullmatch(r"[A-Z]{5}[0-9]{4}[A-Z]{1}", pan_number))
+    return bool(PAN_NUMBER_RE.fullmatch(pan_number))
 
 def validate_aadhaar_number(aadhaar_number):
     if not aadhaar_number:
         return None
-    return bool(re.fullmatch(r"^[2-9]{1}[0-9]{3} ?[0-9]{4} ?[0-9]{4}$", aadhaar_number))
+    return bool(AADHAAR_NUMBER_RE.fullmatch(aadhaar_number))
 
 def validate_date(date_str):
     if not date_str:
         return None, None
-    # Try to parse and convert to DD/MM/YYYY
-    for fmt in ("%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%m/%d/%Y", "%d.%m.%Y"):
-        try:
-            dt = datetime.strptime(date_str, fmt)
-            return dt.strftime("%d/%m/%Y"), True
-        except Exception:
-            continue
+    # Parse and convert to DD/MM/YYYY without strptime's exception-driven format probing
+    match = DAY_FIRST_DATE_RE.fullmatch(date_str)
+    if match:
+        first, sep, second, year = int(match.group(1)), match.group(2), int(match.group(3)), int(match.group(4))
+        # A space-padded part can only be the day
+        if not match.group(3).startswith(" ") and _is_valid_date(year, second, first):
+            return f"{first:02d}/{second:02d}/{year}", True
+        if sep == "/" and not match.group(1).startswith(" ") and _is_valid_date(year, first, second):
+            return f"{second:02d}/{first:02d}/{year}", True
+        return date_str, False
+    match = ISO_DATE_RE.fullmatch(date_str)
+    if match:
+        year, month, day = int(match.group(1)), int(match.group(2)), int(match.group(3))
+        if _is_valid_date(year, month, day):
+            return f"{day:02d}/{month:02d}/{year}", True
     return date_str, False
 
 def validate_field(value, validator):
@@ -346,76 +1595,1246 @@ def validate_field(value, validator):
     valid = validator(value)
     return {"value": value, "valid": valid}
 
+# Field rules: each takes the raw extracted value and returns {"value": ..., "valid": ...}
+def plain_rule(value):
+    return {"value": value, "valid": None}
+
+def date_rule(value):
+    normalized, valid = validate_date(value)
+    if not normalized:
+        return {"value": None, "valid": None}
+    return {"value": normalized, "valid": valid}
+
+def pattern_rule(validator):
+    return lambda value: validate_field(value, validator)
+
+def choice_rule(*choices):
+    return lambda value: {"value": value, "valid": value in choices}
+
+# Declarative validation schema per card: dotted field path -> rule, in output order.
+# Supporting a new card type only needs an entry here (plus its CARD_KEYS name).
+CARD_SCHEMAS = {
+    CardType.driving_license: [
+        ("state", plain_rule),
+        ("dlNumber", pattern_rule(validate_dl_number)),
+        ("issueDate", date_rule),
+        ("expiryDate", date_rule),
+        ("name.firstName", plain_rule),
+        ("name.middleName", plain_rule),
+        ("name.lastName", plain_rule),
+        ("address.street", plain_rule),
+        ("address.city", plain_rule),
+        ("address.state", plain_rule),
+        ("address.zipCode", plain_rule),
+        ("sex", choice_rule("M", "F", None)),
+        ("height", plain_rule),
+        ("weight", plain_rule),
+        ("dateOfBirth", date_rule),
+        ("restrictions", plain_rule),
+        ("hairColor", plain_rule),
+        ("eyeColor", plain_rule),
+        ("dd", plain_rule),
+        ("endorsements", plain_rule),
+    ],
+    CardType.pan_card: [
+        ("panNumber", pattern_rule(validate_pan_number)),
+        ("name.firstName", plain_rule),
+        ("name.middleName", plain_rule),
+        ("name.lastName", plain_rule),
+        ("fatherName", plain_rule),
+        ("dateOfBirth", date_rule),
+        ("issueDate", date_rule),
+    ],
+    CardType.aadhaar_card: [
+        ("aadhaarNumber", pattern_rule(validate_aadhaar_number)),
+        ("name", plain_rule),
+        ("dateOfBirth", date_rule),
+        ("gender", choice_rule("M", "F", "Other", None)),
+        ("address.house", plain_rule),
+        ("address.street", plain_rule),
+        ("address.landmark", plain_rule),
+        ("address.city", plain_rule),
+        ("address.state", plain_rule),
+        ("address.pinCode", plain_rule),
+    ],
+}
+
+def compile_schema(fields):
+    """Fold dotted paths into a nested [(key, rule_or_children)] tree walked once per record"""
+    tree: Dict[str, Any] = {}
+    for path, rule in fields:
+        *parents, leaf = path.split(".")
+        node = tree
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[leaf] = rule
+
+    def freeze(node):
+        return tuple((key, freeze(child) if isinstance(child, dict) else child) for key, child in node.items())
+
+    return freeze(tree)
+
+def run_schema(compiled, source):
+    if not isinstance(source, dict):
+        source = {}
+    get = source.get
+    return {
+        key: run_schema(spec, get(key)) if isinstance(spec, tuple) else spec(get(key))
+        for key, spec in compiled
+    }
+
+COMPILED_SCHEMAS = {
+    card_type: (CARD_KEYS[card_type], compile_schema(fields)) for card_type, fields in CARD_SCHEMAS.items()
+}
+FIELD_RULES = {card_type: dict(fields) for card_type, fields in CARD_SCHEMAS.items()}
+
+def stream_field_event(card_type: CardType, path: str, value) -> Optional[dict]:
+    """A streamed leaf coerced and validated as in the final result; None for fields the card doesn't have"""
+    card_key = CARD_KEYS[card_type]
+    names = path.split(".")
+    if names[0] == card_key:
+        names = names[1:]
+    model, field = CARD_MODELS[card_type], None
+    for name in names:
+        field = model.__fields__.get(name) if model is not None else None
+        if field is None:
+            return None
+        model = field.type_ if _is_model(field.type_) else None
+    if field is None:
+        return None
+    relative = ".".join(names)
+    event = {"path": f"{card_key}.{relative}", "value": coerce_field(field, value)}
+    rule = FIELD_RULES.get(card_type, {}).get(relative)
+    if rule is not None:
+        event["validation"] = rule(event["value"])
+    return event
+
 def validate_card_fields(card_type, data):
-    if card_type == CardType.driving_license:
-        dl = data.get("drivingLicense", {})
-        # Validate fields
-        result = {
-            "drivingLicense": {
-                "state": {"value": dl.get("state"), "valid": None},
-                "dlNumber": validate_field(dl.get("dlNumber"), validate_dl_number),
-                "issueDate": validate_date(dl.get("issueDate"))[0] and {"value": validate_date(dl.get("issueDate"))[0], "valid": validate_date(dl.get("issueDate"))[1]} or {"value": None, "valid": None},
-                "expiryDate": validate_date(dl.get("expiryDate"))[0] and {"value": validate_date(dl.get("expiryDate"))[0], "valid": validate_date(dl.get("expiryDate"))[1]} or {"value": None, "valid": None},
-                "name": {
-                    "firstName": {"value": dl.get("name", {}).get("firstName"), "valid": None},
-                    "middleName": {"value": dl.get("name", {}).get("middleName"), "valid": None},
-                    "lastName": {"value": dl.get("name", {}).get("lastName"), "valid": None},
-                },
-                "address": {
-                    "street": {"value": dl.get("address", {}).get("street"), "valid": None},
-                    "city": {"value": dl.get("address", {}).get("city"), "valid": None},
-                    "state": {"value": dl.get("address", {}).get("state"), "valid": None},
-                    "zipCode": {"value": dl.get("address", {}).get("zipCode"), "valid": None},
-                },
-                "sex": {"value": dl.get("sex"), "valid": dl.get("sex") in ["M", "F", None]},
-                "height": {"value": dl.get("height"), "valid": None},
-                "weight": {"value": dl.get("weight"), "valid": None},
-                "dateOfBirth": validate_date(dl.get("dateOfBirth"))[0] and {"value": validate_date(dl.get("dateOfBirth"))[0], "valid": validate_date(dl.get("dateOfBirth"))[1]} or {"value": None, "valid": None},
-                "restrictions": {"value": dl.get("restrictions"), "valid": None},
-                "hairColor": {"value": dl.get("hairColor"), "valid": None},
-                "eyeColor": {"value": dl.get("eyeColor"), "valid": None},
-                "dd": {"value": dl.get("dd"), "valid": None},
-                "endorsements": {"value": dl.get("endorsements"), "valid": None},
-            }
+    compiled = COMPILED_SCHEMAS.get(card_type)
+    if compiled is None:
+        return data
+    card_key, schema = compiled
+    return {card_key: run_schema(schema, data.get(card_key))}
+
+def image_too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Image exceeds {IMAGE_MAX_BYTES} bytes")
+
+def decode_image(image_data: str) -> bytes:
+    if len(image_data) * 3 // 4 > IMAGE_MAX_BYTES:
+        raise image_too_large()
+    try:
+        try:
+            raw = base64.b64decode(image_data, validate=True)
+        except binascii.Error:
+            # Line-wrapped base64 (as `base64` and MIME emit it) is still accepted
+            raw = base64.b64decode("".join(image_data.split()), validate=True)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Image data is not valid base64")
+    if not raw:
+        raise HTTPException(status_code=400, detail="No image data provided")
+    return raw
+
+async def read_limited(request: Request) -> bytes:
+    """Read a raw request body, enforcing IMAGE_MAX_BYTES before and while it streams in"""
+    if int(request.headers.get("content-length") or 0) > IMAGE_MAX_BYTES:
+        raise image_too_large()
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > IMAGE_MAX_BYTES:
+            raise image_too_large()
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+async def read_upload(file: UploadFile) -> bytes:
+    """The multipart parser has already spooled the file, so check its size and read it once"""
+    if file.size is not None and file.size > IMAGE_MAX_BYTES:
+        raise image_too_large()
+    raw = await file.read()
+    if len(raw) > IMAGE_MAX_BYTES:
+        raise image_too_large()
+    return raw
+
+def normalize_image(raw: bytes, mime_type: str) -> Tuple[bytes, str, dict]:
+    """Decode, EXIF-rotate, downscale and re-encode an upload before it is sent upstream"""
+    from PIL import Image, ImageOps  # Imported lazily to keep cold starts fast
+
+    started = time.perf_counter()
+    if len(raw) > IMAGE_MAX_BYTES:
+        raise image_too_large()
+    try:
+        img = Image.open(io.BytesIO(raw))  # Only reads the header; pixels load lazily
+    except Exception:
+        raise HTTPException(status_code=400, detail="Could not decode image")
+    width, height = img.size
+    if width * height > IMAGE_MAX_PIXELS:
+        raise HTTPException(status_code=413, detail=f"Image exceeds {IMAGE_MAX_PIXELS} pixels")
+
+    try:
+        if img.format == "JPEG":
+            img.draft("RGB", (IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))  # Fast DCT-domain downscale
+        orientation = img.getexif().get(0x0112, 1)
+        rotated = ImageOps.exif_transpose(img)
+        resized = max(rotated.size) > IMAGE_MAX_DIMENSION
+        if resized:
+            rotated.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+        if rotated.mode != "RGB":
+            rotated = rotated.convert("RGB")
+        out = io.BytesIO()
+        rotated.save(out, format=IMAGE_OUTPUT_FORMAT, quality=IMAGE_QUALITY, optimize=True)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not process image: {str(e)}")
+    encoded = out.getvalue()
+
+    report = {
+        "original_bytes": len(raw),
+        "original_size": [width, height],
+        "bytes": len(encoded),
+        "size": list(rotated.size),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+    # Keep the original when re-encoding would not shrink an already-upright, small image. Upright means
+    # no EXIF orientation to apply: a 180-degree or mirrored image (orientations 2-4) keeps its size.
+    upright = orientation in (None, 1)
+    if len(encoded) >= len(raw) and not resized and upright and rotated.size == (width, height):
+        report.update(bytes=len(raw), normalized=False)
+        return raw, mime_type, report
+    report["normalized"] = True
+    return encoded, f"image/{IMAGE_OUTPUT_FORMAT.lower()}", report
+
+def image_digest(raw: bytes) -> bytes:
+    return hashlib.sha256(raw).digest()
+
+def result_cache_key(digest: bytes, card_type: CardType, refine: bool = False) -> str:
+    h = hashlib.sha256(digest)
+    prompts = (LOCATE_PROMPTS if refine else PROMPTS)
+    # auto depends on the classifier and on every card's prompt
+    card_types = list(CARD_KEYS) if card_type == CardType.auto else [card_type]
+    parts = [card_type.value]
+    for prompted in card_types:
+        parts += [prompts[prompted]["system"], json.dumps(prompts[prompted]["response_format"])]
+    parts.append(OPENROUTER_MODEL)
+    if card_type == CardType.auto:
+        parts += [CLASSIFIER_PROMPT, CLASSIFIER_MODEL]
+    for part in parts:
+        h.update(b"\0" + part.encode())
+    return h.hexdigest()
+
+class ResultCache:
+    """In-process LRU (TTL + entry/byte bounds) with an optional SQLite tier, used off the event loop"""
+
+    def __init__(
+        self, ttl: float, max_entries: int, max_bytes: int, db_path: Optional[str] = None,
+        db_max_entries: Optional[int] = None,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.db_max_entries = db_max_entries or max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, payload)
+        self._bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.write_errors = 0
+        self.disk_evictions = 0
+        self.db_path = db_path
+        self._db = None
+        self._lock = threading.Lock()  # One statement at a time on the shared connection
+        self._pending: Dict[str, tuple] = {}  # key -> (expires_at, payload) not yet written to SQLite
+        self._flusher: Optional[asyncio.Task] = None
+        self._pruned_at = 0.0
+
+    def open(self):
+        """Connect the SQLite tier; until then only the in-memory tier is used"""
+        if self.db_path and self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, expires_at REAL, payload TEXT)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_expires_at ON results (expires_at)")
+            self._prune()
+            self._db.commit()
+
+    async def close(self):
+        if self._flusher is not None:
+            await self._flusher
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _put_memory(self, key: str, expires_at: float, payload: str):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old[1])
+        self._entries[key] = (expires_at, payload)
+        self._bytes += len(payload)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def _read(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            return self._db.execute("SELECT expires_at, payload FROM results WHERE key = ?", (key,)).fetchone()
+
+    def _write(self, rows: List[tuple]):
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO results (key, expires_at, payload) VALUES (?, ?, ?)", rows)
+            if time.time() - self._pruned_at > RESULT_CACHE_PRUNE_INTERVAL:
+                self._prune()
+            self._db.commit()
+
+    def _prune(self):
+        """Delete expired rows, then the soonest-expiring ones (the oldest writes) beyond db_max_entries"""
+        self._pruned_at = now = time.time()
+        deleted = self._db.execute("DELETE FROM results WHERE expires_at <= ?", (now,)).rowcount
+        deleted += self._db.execute(
+            "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.db_max_entries,),
+        ).rowcount
+        self.disk_evictions += deleted
+
+    async def _flush(self):
+        """Write-behind: everything set while a batch commits goes out in the next one"""
+        try:
+            while self._pending:
+                rows = [(key, expires_at, payload) for key, (expires_at, payload) in self._pending.items()]
+                self._pending = {}
+                try:
+                    await asyncio.to_thread(self._write, rows)
+                except sqlite3.Error:
+                    self.write_errors += 1  # The memory tier still has them; only persistence is lost
+        finally:
+            self._flusher = None
+
+    async def get(self, key: str) -> Optional[APIResponse]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return APIResponse.parse_raw(entry[1])
+            self._bytes -= len(self._entries.pop(key)[1])
+        if self._db is not None:
+            row = self._pending.get(key)  # Evicted from memory before its write landed
+            if row is None:
+                row = await asyncio.to_thread(self._read, key)
+            if row and row[0] > now:
+                self._put_memory(key, row[0], row[1])
+                self.hits += 1
+                self.disk_hits += 1
+                return APIResponse.parse_raw(row[1])
+        self.misses += 1
+        return None
+
+    def set(self, key: str, response: APIResponse):
+        expires_at = time.time() + self.ttl
+        payload = response.json()
+        self._put_memory(key, expires_at, payload)
+        if self._db is not None:
+            self._pending[key] = (expires_at, payload)
+            if self._flusher is None:
+                self._flusher = asyncio.create_task(self._flush())
+
+    async def clear(self) -> int:
+        cleared = len(self._entries)
+        self._entries.clear()
+        self._bytes = 0
+        self._pending.clear()
+        if self._db is not None:
+            if self._flusher is not None:
+                await self._flusher  # A batch already handed to SQLite must not land after the delete
+            cleared = max(cleared, await asyncio.to_thread(self._delete_all))
+        return cleared
+
+    def _delete_all(self) -> int:
+        with self._lock:
+            cleared = self._db.execute("DELETE FROM results").rowcount
+            self._db.commit()
+            return cleared
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": RESULT_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk_evictions": self.disk_evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "persistent": self._db is not None,
+            "pending_writes": len(self._pending),
+            "write_errors": self.write_errors,
         }
-        return result
-    elif card_type == CardType.pan_card:
-        pan = data.get("panCard", {})
-        result = {
-            "panCard": {
-                "panNumber": validate_field(pan.get("panNumber"), validate_pan_number),
-                "name": {
-                    "firstName": {"value": pan.get("name", {}).get("firstName"), "valid": None},
-                    "middleName": {"value": pan.get("name", {}).get("middleName"), "valid": None},
-                    "lastName": {"value": pan.get("name", {}).get("lastName"), "valid": None},
-                },
-                "fatherName": {"value": pan.get("fatherName"), "valid": None},
-                "dateOfBirth": validate_date(pan.get("dateOfBirth"))[0] and {"value": validate_date(pan.get("dateOfBirth"))[0], "valid": validate_date(pan.get("dateOfBirth"))[1]} or {"value": None, "valid": None},
-                "issueDate": validate_date(pan.get("issueDate"))[0] and {"value": validate_date(pan.get("issueDate"))[0], "valid": validate_date(pan.get("issueDate"))[1]} or {"value": None, "valid": None},
-            }
+
+result_cache = ResultCache(
+    RESULT_CACHE_TTL, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_DB, RESULT_CACHE_DB_MAX_ENTRIES
+)
+
+class InMemoryJobStore:
+    """Default job backend; jobs are lost on restart"""
+
+    blocking = False  # Plain dict operations, safe to call on the event loop
+
+    def __init__(self):
+        self._jobs: Dict[str, dict] = {}
+
+    def open(self):
+        pass
+
+    def create(self, job_id: str, request: JobRequest):
+        self._prune()
+        self._jobs[job_id] = {
+            "id": job_id, "status": JobStatus.queued, "created_at": time.time(),
+            "started_at": None, "finished_at": None, "request": request, "result": None,
         }
-        return result
-    elif card_type == CardType.aadhaar_card:
-        aadhaar = data.get("aadhaarCard", {})
-        result = {
-            "aadhaarCard": {
-                "aadhaarNumber": validate_field(aadhaar.get("aadhaarNumber"), validate_aadhaar_number),
-                "name": {"value": aadhaar.get("name"), "valid": None},
-                "dateOfBirth": validate_date(aadhaar.get("dateOfBirth"))[0] and {"value": validate_date(aadhaar.get("dateOfBirth"))[0], "valid": validate_date(aadhaar.get("dateOfBirth"))[1]} or {"value": None, "valid": None},
-                "gender": {"value": aadhaar.get("gender"), "valid": aadhaar.get("gender") in ["M", "F", "Other", None]},
-                "address": {
-                    "house": {"value": aadhaar.get("address", {}).get("house"), "valid": None},
-                    "street": {"value": aadhaar.get("address", {}).get("street"), "valid": None},
-                    "landmark": {"value": aadhaar.get("address", {}).get("landmark"), "valid": None},
-                    "city": {"value": aadhaar.get("address", {}).get("city"), "valid": None},
-                    "state": {"value": aadhaar.get("address", {}).get("state"), "valid": None},
-                    "pinCode": {"value": aadhaar.get("address", {}).get("pinCode"), "valid": None},
-                }
-            }
+
+    def get(self, job_id: str) -> Optional[JobInfo]:
+        job = self._jobs.get(job_id)
+        return JobInfo(**job) if job else None
+
+    def get_request(self, job_id: str) -> Optional[JobRequest]:
+        job = self._jobs.get(job_id)
+        return job["request"] if job else None
+
+    def claim(self, job_id: str) -> bool:
+        """Mark a queued job running; False if it is gone or another worker already took it"""
+        job = self._jobs.get(job_id)
+        if job is None or job["status"] != JobStatus.queued:
+            return False
+        job.update(status=JobStatus.running, started_at=time.time())
+        return True
+
+    def finish(self, job_id: str, result: APIResponse):
+        status = JobStatus.done if result.success else JobStatus.failed
+        # Drop the image payload once the job is finished
+        self._jobs[job_id].update(status=status, finished_at=time.time(), result=result, request=None)
+
+    def unfinished(self) -> List[str]:
+        return [j["id"] for j in self._jobs.values() if j["status"] == JobStatus.queued]
+
+    def stats(self) -> dict:
+        counts = {status.value: 0 for status in JobStatus}
+        oldest = None
+        for job in self._jobs.values():
+            counts[job["status"].value] += 1
+            if job["status"] == JobStatus.queued and (oldest is None or job["created_at"] < oldest):
+                oldest = job["created_at"]
+        return {"counts": counts, "oldest_queued_at": oldest}
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RESULT_TTL
+        for job_id in [j["id"] for j in self._jobs.values() if j["finished_at"] and j["finished_at"] < cutoff]:
+            del self._jobs[job_id]
+
+class SQLiteJobStore:
+    """Durable job backend shared by every worker process; unfinished jobs are re-queued on startup"""
+
+    blocking = True  # Statements wait up to the busy timeout for other workers; JobQueue runs them in a thread
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._db = None
+        self._lock = threading.Lock()  # One transaction at a time on the shared connection
+        self._pruned_at = 0.0
+
+    def open(self):
+        with self._lock:
+            self._open()
+
+    def _open(self):
+        if self._db is not None:
+            return
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, created_at REAL, "
+            "started_at REAL, finished_at REAL, request TEXT, result TEXT, lease_until REAL)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "lease_until" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at)")
+        self._db.commit()
+
+    def create(self, job_id: str, request: JobRequest):
+        payload = request.json()
+        with self._lock:
+            now = time.time()
+            if now - self._pruned_at > JOB_PRUNE_INTERVAL:
+                self._pruned_at = now
+                self._db.execute("DELETE FROM jobs WHERE finished_at < ?", (now - JOB_RESULT_TTL,))
+            self._db.execute(
+                "INSERT INTO jobs (id, status, created_at, request) VALUES (?, ?, ?, ?)",
+                (job_id, JobStatus.queued.value, now, payload),
+            )
+            self._db.commit()
+
+    def get(self, job_id: str) -> Optional[JobInfo]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, created_at, started_at, finished_at, result FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return JobInfo(
+            id=row[0], status=row[1], created_at=row[2], started_at=row[3], finished_at=row[4],
+            result=APIResponse.parse_raw(row[5]) if row[5] else None,
+        )
+
+    def get_request(self, job_id: str) -> Optional[JobRequest]:
+        with self._lock:
+            row = self._db.execute("SELECT request FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return JobRequest.parse_raw(row[0]) if row and row[0] else None
+
+    def claim(self, job_id: str) -> bool:
+        """Atomically move a queued job to running, so only one worker process runs it"""
+        with self._lock:
+            now = time.time()
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, lease_until = ? WHERE id = ? AND status = ?",
+                (JobStatus.running.value, now, now + JOB_LEASE_SECONDS, job_id, JobStatus.queued.value),
+            )
+            self._db.commit()
+            return cursor.rowcount == 1
+
+    def finish(self, job_id: str, result: APIResponse):
+        status = JobStatus.done if result.success else JobStatus.failed
+        payload = result.json()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, request = NULL WHERE id = ?",
+                (status.value, time.time(), payload, job_id),
+            )
+            self._db.commit()
+
+    def unfinished(self) -> List[str]:
+        with self._lock:
+            # Running jobs belong to a live sibling worker until their lease runs out
+            self._db.execute(
+                "UPDATE jobs SET status = ? WHERE status = ? AND (lease_until IS NULL OR lease_until < ?)",
+                (JobStatus.queued.value, JobStatus.running.value, time.time()),
+            )
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (JobStatus.queued.value,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def stats(self) -> dict:
+        counts = {status.value: 0 for status in JobStatus}
+        with self._lock:
+            counts.update(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = self._db.execute(
+                "SELECT MIN(created_at) FROM jobs WHERE status = ?", (JobStatus.queued.value,)
+            ).fetchone()[0]
+        return {"counts": counts, "oldest_queued_at": oldest}
+
+def _host_allowed(host: str) -> bool:
+    return any(host == h or (h.startswith(".") and host.endswith(h)) for h in JOB_CALLBACK_ALLOWED_HOSTS)
+
+def _public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+async def check_callback_url(url: str):
+    """Reject callback URLs that would make the server call internal hosts (SSRF)"""
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:  # Unbalanced IPv6 brackets, non-numeric or out-of-range port
+        raise HTTPException(status_code=400, detail="callback_url must be an http(s) URL")
+    if parts.scheme not in ("http", "https") or not host:
+        raise HTTPException(status_code=400, detail="callback_url must be an http(s) URL")
+    if JOB_CALLBACK_ALLOWED_HOSTS:
+        if not _host_allowed(host):
+            raise HTTPException(status_code=400, detail="callback_url host is not allowed")
+        return
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError):
+        raise HTTPException(status_code=400, detail="callback_url host does not resolve")
+    if not infos or not all(_public_address(info[4][0]) for info in infos):
+        raise HTTPException(status_code=400, detail="callback_url must resolve to a public address")
+
+class JobQueue:
+    """Bounded queue of job ids drained by a pool of background workers"""
+
+    def __init__(self, store, workers: int, maxsize: int):
+        self.store = store
+        self.workers = workers
+        self.maxsize = maxsize
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._draining = False
+        self._callback_client: Optional[httpx.AsyncClient] = None
+
+    async def _call(self, method: str, *args):
+        """Store call; a blocking store runs in a thread so a locked database stalls only this caller"""
+        fn = getattr(self.store, method)
+        if self.store.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def start(self):
+        await self._call("open")
+        self._queue = asyncio.Queue()
+        # Redirects are not followed, so an allowed host cannot bounce the request somewhere internal
+        self._callback_client = httpx.AsyncClient(timeout=JOB_CALLBACK_TIMEOUT, follow_redirects=False)
+        self._draining = False
+        for job_id in await self._call("unfinished"):
+            self._queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 0):
+        # Stop accepting work, give queued jobs a bounded chance to finish, then cancel the rest
+        self._draining = True
+        if self._queue is not None and drain_timeout > 0:
+            try:
+                await asyncio.wait_for(self._queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        if self._callback_client is not None:
+            await self._callback_client.aclose()
+            self._callback_client = None
+
+    async def submit(self, request: JobRequest) -> str:
+        if self._queue is None or self._draining:
+            raise HTTPException(status_code=503, detail="Job queue is not running")
+        if self._queue.qsize() >= self.maxsize:
+            raise HTTPException(status_code=429, detail="Job queue is full", headers={"Retry-After": "5"})
+        job_id = uuid.uuid4().hex
+        await self._call("create", job_id, request)
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[JobInfo]:
+        return await self._call("get", job_id)
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def stats(self) -> dict:
+        stats = await self._call("stats")
+        oldest = stats.pop("oldest_queued_at")
+        stats.update(
+            depth=self.depth(),
+            capacity=self.maxsize,
+            workers=len(self._tasks),
+            oldest_queued_age_s=round(time.time() - oldest, 3) if oldest else 0.0,
+        )
+        return stats
+
+    async def _worker(self):
+        _priority.set(Priority.bulk)
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                # e.g. "database is locked" from the store; one bad job must not take the worker down
+                JOB_ERRORS.inc()
+                logger.exception("Background job %s failed", job_id)
+                await self._fail(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _fail(self, job_id: str):
+        """Best effort: mark the job failed so pollers stop waiting on it"""
+        try:
+            await self._call("finish", job_id, APIResponse(success=False, error="Job failed: internal error"))
+        except Exception:
+            pass  # Left running or queued; the next startup re-queues it once its lease runs out
+
+    async def _run(self, job_id: str):
+        # Every worker process re-queues unfinished jobs on startup; the claim makes sure one runs each
+        if not await self._call("claim", job_id):
+            return
+        request = await self._call("get_request", job_id)
+        if request is None:
+            return
+        try:
+            result = await process_extraction(
+                ImageData(**request.dict(exclude={"callback_url", "refine"})), refine=request.refine
+            )
+        except HTTPException as e:
+            result = APIResponse(success=False, error=str(e.detail))
+        except Exception as e:
+            result = APIResponse(success=False, error=f"Failed to process image: {str(e)}")
+        await self._call("finish", job_id, result)
+        if request.callback_url:
+            await self._deliver(request.callback_url, await self.get(job_id))
+
+    async def _deliver(self, url: str, job: JobInfo):
+        try:
+            # Checked again at delivery, since DNS may have changed since the job was submitted
+            await check_callback_url(url)
+            await self._callback_client.post(url, content=job.json(), headers={"Content-Type": "application/json"})
+        except (httpx.HTTPError, HTTPException):
+            pass  # Clients can still poll /jobs/{id}
+
+job_queue = JobQueue(
+    SQLiteJobStore(JOB_DB) if JOB_STORE == "sqlite" else InMemoryJobStore(),
+    JOB_WORKERS,
+    JOB_QUEUE_MAX,
+)
+
+async def process_extraction(image_data: ImageData, use_cache: bool = True, refine: bool = False) -> APIResponse:
+    if not image_data.image_data:
+        raise HTTPException(status_code=400, detail="No image data provided")
+    with stage_timer("decode", image_data.card_type):
+        raw = decode_image(image_data.image_data)
+    return await process_image(raw, image_data.mime_type, image_data.card_type, use_cache, refine)
+
+def record_validation_metrics(card_type: CardType, validation: dict, prefix: str = ""):
+    for key, node in validation.items():
+        if not isinstance(node, dict):
+            continue
+        if "valid" in node and "value" in node:
+            if node["valid"] is not None:
+                VALIDATION_RESULTS.inc(
+                    card_type=card_type.value, field=prefix + key, result="pass" if node["valid"] else "fail"
+                )
+        else:
+            record_validation_metrics(card_type, node, f"{prefix}{key}.")
+
+def build_api_response(
+    card_type: CardType,
+    extracted_info: Dict[str, Any],
+    preprocessing: Optional[dict] = None,
+    refinement: Optional[dict] = None,
+    truncated: bool = False,
+) -> APIResponse:
+    # Build ExtractedData for the main data field
+    with stage_timer("model", card_type):
+        data_obj = ExtractedData()
+        if card_type == CardType.driving_license:
+            data_obj.drivingLicense = DrivingLicense(**extracted_info.get("drivingLicense", {}))
+        elif card_type == CardType.pan_card:
+            data_obj.panCard = PanCard(**extracted_info.get("panCard", {}))
+        elif card_type == CardType.aadhaar_card:
+            data_obj.aadhaarCard = AadhaarCard(**extracted_info.get("aadhaarCard", {}))
+    # Validation results (regex etc.)
+    with stage_timer("validate", card_type):
+        validation_results = validate_card_fields(card_type, extracted_info)
+    record_validation_metrics(card_type, validation_results.get(CARD_KEYS[card_type], {}))
+    return APIResponse(
+        success=True,
+        data=data_obj,
+        validation=validation_results,
+        preprocessing=preprocessing,
+        refinement=refinement,
+        truncated=truncated or None
+    )
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key onto one in-flight task"""
+
+    def __init__(self):
+        self._calls: Dict[str, list] = {}  # key -> [task, waiter_count]
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn):
+        entry = self._calls.get(key)
+        if entry is None:
+            entry = [asyncio.ensure_future(fn()), 0]
+            self._calls[key] = entry
+            entry[0].add_done_callback(lambda _: self._forget(key, entry))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        entry[1] += 1
+        try:
+            # Shielded so one caller's cancellation does not abort the call for the others
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                entry[0].cancel()  # Every caller is gone
+                self._forget(key, entry)
+
+    def _forget(self, key: str, entry: list):
+        if self._calls.get(key) is entry:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "upstream_calls_saved": self.coalesced}
+
+single_flight = SingleFlight()
+
+async def lookup_image(
+    raw: bytes, mime_type: str, card_type: CardType, use_cache: bool, refine: bool = False,
+    digest: Optional[bytes] = None,
+) -> Tuple[str, Optional[APIResponse]]:
+    """Validate an upload and check the result cache; returns (cache_key, cached_response). Pass digest
+    when the caller has already hashed raw."""
+    if not raw:
+        raise HTTPException(status_code=400, detail="No image data provided")
+    if not mime_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="Invalid image format")
+    PAYLOAD_BYTES.inc(len(raw), direction="upload", card_type=card_type.value)
+    cache_key = result_cache_key(digest or image_digest(raw), card_type, refine)
+    if use_cache and RESULT_CACHE_ENABLED:
+        return cache_key, await result_cache.get(cache_key)
+    return cache_key, None
+
+async def preprocess_image(raw: bytes, mime_type: str, card_type: CardType) -> Tuple[bytes, str, Optional[dict]]:
+    if not IMAGE_NORMALIZE:
+        return raw, mime_type, None
+    with stage_timer("normalize", card_type):
+        return await asyncio.to_thread(normalize_image, raw, mime_type)
+
+_in_flight_extractions = 0
+
+@contextmanager
+def track_in_flight():
+    global _in_flight_extractions
+    _in_flight_extractions += 1
+    try:
+        yield
+    finally:
+        _in_flight_extractions -= 1
+
+async def drain_extractions(timeout: float):
+    deadline = time.monotonic() + timeout
+    while _in_flight_extractions and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+
+REFINE_PROMPT = """You will receive close-up crops of individual fields from one {document}.
+Each crop is preceded by its field path and the value read from the full document.
+Transcribe each field exactly as printed in its crop; use null if it is not legible.
+Return ONLY a JSON object: {{"fields": {{"<field path>": "<value or null>"}}}}"""
+
+def get_path(values: dict, path: str):
+    for key in path.split("."):
+        if not isinstance(values, dict):
+            return None
+        values = values.get(key)
+    return values
+
+def set_path(values: dict, path: str, value):
+    *parents, leaf = path.split(".")
+    for key in parents:
+        if not isinstance(values.get(key), dict):
+            values[key] = {}
+        values = values[key]
+    values[leaf] = value
+
+def field_locations(card_type: CardType, extracted: Dict[str, Any]) -> Dict[str, dict]:
+    """Pop the per-field boxes and confidences out of a locate-mode extraction"""
+    card = extracted.get(CARD_KEYS[card_type])
+    entries = extracted.pop("_fields", None)
+    if entries is None and isinstance(card, dict):
+        entries = card.pop("_fields", None)  # Card wrapper was restored around the whole reply
+    allowed = set(LOCATABLE_FIELDS[card_type])
+    locations = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict) or entry.get("path") not in allowed:
+            continue
+        try:
+            confidence = min(1.0, max(0.0, float(entry.get("confidence"))))
+        except (TypeError, ValueError):
+            confidence = None
+        locations[entry["path"]] = {"bbox": _clean_bbox(entry.get("bbox") or (), min_size=0.005), "confidence": confidence}
+    return locations
+
+def refine_candidates(card_type: CardType, card: dict, locations: Dict[str, dict]) -> List[Tuple[str, str]]:
+    """(path, reason) for fields worth re-reading: failed validation first, then least confident"""
+    rules = FIELD_RULES.get(card_type, {})
+    invalid, unsure = [], []
+    for path, location in locations.items():
+        if location["bbox"] is None:
+            continue
+        if rules.get(path, plain_rule)(get_path(card, path))["valid"] is False:
+            invalid.append((path, "invalid"))
+        elif location["confidence"] is not None and location["confidence"] < REFINE_CONFIDENCE_THRESHOLD:
+            unsure.append((location["confidence"], path))
+    return (invalid + [(path, "low_confidence") for _, path in sorted(unsure)])[:REFINE_MAX_FIELDS]
+
+def crop_fields(raw: bytes, bboxes: List[List[float]], frame: Optional[List[float]] = None) -> List[bytes]:
+    """Crop field boxes from the full-resolution upload, decoded once and turned upright. Boxes are
+    fractions of frame, the region of the upload the model saw (default: all of it)."""
+    from PIL import Image, ImageOps
+
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(raw))).convert("RGB")
+    width, height = img.size
+    fx0, fy0, fx1, fy1 = frame or (0.0, 0.0, 1.0, 1.0)
+    crops = []
+    for x0, y0, x1, y1 in bboxes:
+        x0, x1 = fx0 + x0 * (fx1 - fx0), fx0 + x1 * (fx1 - fx0)
+        y0, y1 = fy0 + y0 * (fy1 - fy0), fy0 + y1 * (fy1 - fy0)
+        crop = img.crop((
+            max(0, int((x0 - REFINE_CROP_PADDING) * width)),
+            max(0, int((y0 - REFINE_CROP_PADDING) * height)),
+            min(width, int((x1 + REFINE_CROP_PADDING) * width)),
+            min(height, int((y1 + REFINE_CROP_PADDING) * height)),
+        ))
+        crop.thumbnail((REFINE_CROP_MAX_DIMENSION, REFINE_CROP_MAX_DIMENSION), Image.LANCZOS)
+        out = io.BytesIO()
+        crop.save(out, format="JPEG", quality=IMAGE_QUALITY)
+        crops.append(out.getvalue())
+    return crops
+
+async def refine_fields(
+    raw: bytes, card_type: CardType, extracted: Dict[str, Any], frame: Optional[List[float]] = None
+) -> Tuple[Dict[str, Any], dict]:
+    """Re-read invalid or low-confidence fields from crops in one follow-up call and merge them back"""
+    card_key = CARD_KEYS[card_type]
+    locations = field_locations(card_type, extracted)
+    card = extracted.setdefault(card_key, {})
+    candidates = refine_candidates(card_type, card, locations)
+    report = {"locations": locations, "requested": dict(candidates), "changed": [], "round_trips": 0}
+    if not candidates:
+        REFINEMENTS.inc(card_type=card_type.value, outcome="skipped")
+        return extracted, report
+
+    try:
+        with stage_timer("crop", card_type):
+            crops = await asyncio.to_thread(
+                crop_fields, raw, [locations[path]["bbox"] for path, _ in candidates], frame
+            )
+        content = []
+        for (path, reason), crop in zip(candidates, crops):
+            note = "fails the format check" if reason == "invalid" else "is uncertain"
+            content.append({"type": "text", "text": f"{path}: read as {json.dumps(get_path(card, path))}, which {note}"})
+            content.append({
+                "type": "image_url",
+                "image_url": {"url": f"data:image/jpeg;base64,{base64.b64encode(crop).decode()}", "detail": "high"}
+            })
+        payload = {
+            "messages": [
+                {"role": "system", "content": REFINE_PROMPT.format(document=card_type.value.replace("_", " "))},
+                {"role": "user", "content": content},
+            ],
+            "temperature": 0,
+            "max_tokens": MAX_TOKENS_OVERHEAD + MAX_TOKENS_PER_FIELD * len(candidates),
         }
-        return result
-    else:
-        return data
+        report["round_trips"] = 1
+        REFINE_ROUND_TRIPS.inc(card_type=card_type.value)
+        with stage_timer("refine", card_type):
+            response_data = await upstream.call(payload)
+        report["tokens"] = (response_data.get("usage") or {}).get("total_tokens")
+        if reply_truncated(response_data):
+            report["truncated"] = True
+        fields = parse_model_output(
+            response_data["choices"][0]["message"]["content"], truncated=reply_truncated(response_data)
+        ).get("fields")
+    except UpstreamError as e:
+        report["error"] = e.detail
+    except Exception as e:
+        report["error"] = str(e)
+    if "error" in report:
+        # The first pass already produced a usable result; keep it
+        REFINEMENTS.inc(card_type=card_type.value, outcome="failed")
+        return extracted, report
+
+    fields = fields if isinstance(fields, dict) else {}
+    rules = FIELD_RULES.get(card_type, {})
+    for path, _ in candidates:
+        value = _clean_scalar(fields.get(path))
+        if value is None or value == get_path(card, path):
+            result = "unchanged"
+        elif rules.get(path, plain_rule)(value)["valid"] is False:
+            result = "rejected"  # A second invalid reading is no better than the first
+        else:
+            set_path(card, path, value)
+            report["changed"].append(path)
+            result = "changed"
+        REFINED_FIELDS.inc(card_type=card_type.value, field=path, result=result)
+    REFINEMENTS.inc(card_type=card_type.value, outcome="changed" if report["changed"] else "unchanged")
+    return extracted, report
+
+async def run_extraction(
+    raw: bytes, mime_type: str, card_type: CardType, cache_key: str, refine: bool = False
+) -> APIResponse:
+    with track_in_flight():
+        return await _run_extraction(raw, mime_type, card_type, cache_key, refine)
+
+async def _run_extraction(
+    raw: bytes, mime_type: str, card_type: CardType, cache_key: str, refine: bool = False
+) -> APIResponse:
+    original = raw  # Refinement crops come from the full-resolution upload
+    raw, mime_type, preprocessing = await preprocess_image(raw, mime_type, card_type)
+    response = await extract_card(raw, mime_type, card_type, original, refine, preprocessing)
+    # A truncated reply may come back whole on a retry, so it is not cached
+    if RESULT_CACHE_ENABLED and response.success and not response.truncated:
+        result_cache.set(cache_key, response)
+    return response
+
+async def extract_card(
+    image: bytes,
+    mime_type: str,
+    card_type: CardType,
+    original: bytes,
+    refine: bool = False,
+    preprocessing: Optional[dict] = None,
+    frame: Optional[List[float]] = None,
+) -> APIResponse:
+    """Extract one card from an already normalized image; refinement crops come from original, within frame"""
+    try:
+        extracted_info, truncated = await extract_info_with_openrouter(
+            image,
+            mime_type,
+            card_type,
+            locate=refine
+        )
+        refinement = None
+        if refine:
+            extracted_info, refinement = await refine_fields(original, card_type, extracted_info, frame)
+        return build_api_response(card_type, extracted_info, preprocessing, refinement, truncated)
+    except HTTPException:
+        raise
+    except Exception as e:
+        return APIResponse(
+            success=False,
+            error=f"Failed to process image: {str(e)}"
+        )
+
+CLASSIFIER_PROMPT = """Identify every identity document visible in this image.
+Supported types: driving_license, pan_card, aadhaar_card. Use "other" for anything else.
+Treat the front and the back of a card as separate documents.
+Return ONLY a JSON object: {"documents": [{"card_type": "driving_license", "bbox": [x_min, y_min, x_max, y_max]}]}
+bbox values are fractions (0 to 1) of the image width and height."""
+
+def make_thumbnail(raw: bytes, max_dimension: int) -> bytes:
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(raw))
+    img.draft("RGB", (max_dimension, max_dimension))
+    img = ImageOps.exif_transpose(img).convert("RGB")  # Same upright frame that crop_documents cuts from
+    img.thumbnail((max_dimension, max_dimension))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=80)
+    return out.getvalue()
+
+def crop_documents(raw: bytes, bboxes: List[List[float]]) -> List[Tuple[bytes, List[float]]]:
+    """Cut documents out of the full-resolution upload, decoded once and turned upright, and scale each
+    as normalize_image would, so a crop is encoded once. Also returns each padded crop box as fractions
+    of the image (the frame its field boxes are relative to)."""
+    from PIL import Image, ImageOps
+
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(raw))).convert("RGB")
+    width, height = img.size
+    crops = []
+    for x0, y0, x1, y1 in bboxes:
+        box = (
+            max(0, int((x0 - AUTO_CROP_PADDING) * width)),
+            max(0, int((y0 - AUTO_CROP_PADDING) * height)),
+            min(width, int((x1 + AUTO_CROP_PADDING) * width)),
+            min(height, int((y1 + AUTO_CROP_PADDING) * height)),
+        )
+        crop = img.crop(box)
+        crop.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+        out = io.BytesIO()
+        crop.save(out, format=IMAGE_OUTPUT_FORMAT, quality=IMAGE_QUALITY, optimize=True)
+        crops.append((out.getvalue(), [box[0] / width, box[1] / height, box[2] / width, box[3] / height]))
+    return crops
+
+def _clean_bbox(bbox, min_size: float = 0.05) -> Optional[List[float]]:
+    try:
+        x0, y0, x1, y1 = (min(1.0, max(0.0, float(v))) for v in bbox)
+    except (TypeError, ValueError):
+        return None
+    if x1 - x0 < min_size or y1 - y0 < min_size:
+        return None
+    return [x0, y0, x1, y1]
+
+classifier_upstream = UpstreamRouter([CLASSIFIER_MODEL])
+
+async def classify_documents(raw: bytes) -> List[dict]:
+    """Cheap low-resolution pass that returns [{"card_type": CardType, "bbox": [...] or None}]"""
+    thumbnail = await asyncio.to_thread(make_thumbnail, raw, CLASSIFIER_MAX_DIMENSION)
+    payload = {
+        "messages": [
+            {"role": "system", "content": CLASSIFIER_PROMPT},
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{base64.b64encode(thumbnail).decode()}",
+                            "detail": "low"
+                        }
+                    }
+                ]
+            }
+        ],
+        "temperature": 0,
+        "max_tokens": 64 + 48 * AUTO_MAX_DOCUMENTS,
+    }
+    try:
+        response_data = await classifier_upstream.call(payload)
+        result = parse_model_output(
+            response_data["choices"][0]["message"]["content"], truncated=reply_truncated(response_data)
+        )
+    except UpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=f"Document classification failed: {e.detail}")
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=422, detail=f"Failed to parse classifier response as JSON: {str(e)}")
+    documents = []
+    for doc in result.get("documents") or []:
+        if not isinstance(doc, dict):
+            continue
+        try:
+            card_type = CardType(doc.get("card_type"))
+        except ValueError:
+            continue
+        if card_type in CARD_KEYS:
+            documents.append({"card_type": card_type, "bbox": _clean_bbox(doc.get("bbox") or ())})
+    return documents[:AUTO_MAX_DOCUMENTS]
+
+def merge_card_values(primary: dict, extra: dict) -> dict:
+    """Fill gaps in one side of a card (e.g. the front) with values read from another (the back)"""
+    merged = dict(primary)
+    for key, value in extra.items():
+        current = merged.get(key)
+        if isinstance(current, dict) and isinstance(value, dict):
+            merged[key] = merge_card_values(current, value)
+        elif current in (None, [], "") and value not in (None, [], ""):
+            merged[key] = value
+    return merged
+
+async def process_auto(raw: bytes, mime_type: str, cache_key: str, refine: bool = False) -> APIResponse:
+    with track_in_flight():
+        response = await _process_auto(raw, mime_type, refine)
+    # Cached whole, so a re-upload skips the classifier too; partial or truncated results may do better on a retry
+    if RESULT_CACHE_ENABLED and response.success and not response.truncated and not response.error:
+        result_cache.set(cache_key, response)
+    return response
+
+async def _process_auto(raw: bytes, mime_type: str, refine: bool = False) -> APIResponse:
+    original = raw  # Document and refinement crops come from the full-resolution upload
+    raw, mime_type, preprocessing = await preprocess_image(raw, mime_type, CardType.auto)
+    documents = await classify_documents(raw)
+    if not documents:
+        return APIResponse(success=False, error="No supported document detected in the image")
+
+    # Documents that need cutting out are cropped in one decode of the upload; the rest use the whole image
+    to_crop = [
+        i for i, doc in enumerate(documents)
+        if doc["bbox"] and (
+            len(documents) > 1 or (doc["bbox"][2] - doc["bbox"][0]) * (doc["bbox"][3] - doc["bbox"][1]) < AUTO_FULL_FRAME_AREA
+        )
+    ]
+    crops = {}
+    if to_crop:
+        with stage_timer("crop", CardType.auto):
+            cut = await asyncio.to_thread(crop_documents, original, [documents[i]["bbox"] for i in to_crop])
+        crops = dict(zip(to_crop, cut))
+
+    async def extract(i: int, doc: dict) -> APIResponse:
+        image, crop_mime_type, frame = raw, mime_type, None
+        if i in crops:
+            (image, frame), crop_mime_type = crops[i], f"image/{IMAGE_OUTPUT_FORMAT.lower()}"
+        try:
+            return await extract_card(image, crop_mime_type, doc["card_type"], original, refine, frame=frame)
+        except HTTPException as e:
+            return APIResponse(success=False, error=str(e.detail))
+
+    results = await asyncio.gather(*[extract(i, doc) for i, doc in enumerate(documents)])
+    cards: Dict[CardType, dict] = {}
+    errors = []
+    refinements = []
+    for doc, result in zip(documents, results):
+        if result.refinement is not None:
+            # Field locations are fractions of this document's crop, so its bbox travels with them
+            refinements.append({"card_type": doc["card_type"].value, "bbox": doc["bbox"], **result.refinement})
+        if not result.success:
+            errors.append(f"{doc['card_type'].value}: {result.error}")
+            continue
+        card_key = CARD_KEYS[doc["card_type"]]
+        values = getattr(result.data, card_key).dict()
+        cards[doc["card_type"]] = merge_card_values(cards[doc["card_type"]], values) if doc["card_type"] in cards else values
+    if not cards:
+        return APIResponse(success=False, error="; ".join(errors))
+
+    data_obj = ExtractedData()
+    validation = {}
+    for card_type, values in cards.items():
+        card_key = CARD_KEYS[card_type]
+        setattr(data_obj, card_key, CARD_MODELS[card_type](**values))
+        validation.update(validate_card_fields(card_type, {card_key: values}))
+    preprocessing = dict(preprocessing or {})
+    preprocessing["documents"] = [{"card_type": d["card_type"].value, "bbox": d["bbox"]} for d in documents]
+    return APIResponse(
+        success=True,
+        data=data_obj,
+        validation=validation,
+        preprocessing=preprocessing,
+        refinement={"documents": refinements} if refinements else None,
+        truncated=any(result.truncated for result in results) or None,
+        error="; ".join(errors) or None
+    )
+
+async def process_image(
+    raw: bytes, mime_type: str, card_type: CardType, use_cache: bool = True, refine: bool = False,
+    digest: Optional[bytes] = None,
+) -> APIResponse:
+    cache_key, cached = await lookup_image(raw, mime_type, card_type, use_cache, refine, digest)
+    if cached is not None:
+        return cached
+    if card_type == CardType.auto:
+        return await single_flight.do(cache_key, lambda: process_auto(raw, mime_type, cache_key, refine))
+    return await single_flight.do(cache_key, lambda: run_extraction(raw, mime_type, card_type, cache_key, refine))
+
+def sse_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+async def stream_extraction(raw: bytes, mime_type: str, card_type: CardType, use_cache: bool = True):
+    """Prepare the image up front (so input errors stay 4xx), then return an SSE event generator"""
+    cache_key, cached = await lookup_image(raw, mime_type, card_type, use_cache)
+    if cached is None:
+        raw, mime_type, preprocessing = await preprocess_image(raw, mime_type, card_type)
+
+    async def events():
+        if cached is not None:
+            yield sse_event("result", cached.json())
+            return
+        parser = FieldStreamParser()
+        chunks = []
+        finish: dict = {}
+        try:
+            with track_in_flight():
+                async for delta in stream_openrouter_text(raw, mime_type, card_type, finish):
+                    chunks.append(delta)
+                    for path, value in parser.feed(delta):
+                        event = stream_field_event(card_type, path, value)
+                        if event is not None:
+                            yield sse_event("field", json.dumps(event))
+            truncated = finish.get("reason") == "length"
+            response = build_api_response(
+                card_type, parse_model_output("".join(chunks), card_type, truncated), preprocessing, truncated=truncated
+            )
+        except HTTPException as e:
+            yield sse_event("error", json.dumps({"status": e.status_code, "detail": str(e.detail)}))
+            return
+        except json.JSONDecodeError as e:
+            yield sse_event("error", json.dumps({"status": 422, "detail": f"Failed to parse OpenRouter response as JSON: {str(e)}"}))
+            return
+        except Exception as e:
+            yield sse_event("result", APIResponse(success=False, error=f"Failed to process image: {str(e)}").json())
+            return
+        if RESULT_CACHE_ENABLED and not truncated:
+            result_cache.set(cache_key, response)
+        yield sse_event("result", response.json())
+
+    return events()
 
 @app.get("/")
 async def root():
@@ -439,44 +2858,156 @@ async def extract_license_get():
     }
 
 @app.post("/extract-info", response_model=APIResponse)
-async def extract_info(image_data: ImageData):
-    try:
-        if not image_data.image_data:
-            raise HTTPException(status_code=400, detail="No image data provided")
-        if not image_data.mime_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="Invalid image format")
-        extracted_info = extract_info_with_openrouter(
-            image_data.image_data,
-            image_data.mime_type,
-            image_data.card_type
-        )
-        # Build ExtractedData for the main data field
-        data_obj = ExtractedData()
-        if image_data.card_type == CardType.driving_license:
-            data_obj.drivingLicense = DrivingLicense(**extracted_info.get("drivingLicense", {}))
-        elif image_data.card_type == CardType.pan_card:
-            data_obj.panCard = PanCard(**extracted_info.get("panCard", {}))
-        elif image_data.card_type == CardType.aadhaar_card:
-            data_obj.aadhaarCard = AadhaarCard(**extracted_info.get("aadhaarCard", {}))
-        # Validation results (regex etc.)
-        validation_results = validate_card_fields(image_data.card_type, extracted_info)
-        return APIResponse(
-            success=True,
-            data=data_obj,
-            validation=validation_results
-        )
-    except HTTPException:
-        raise
-    except Exception as e:
-        return APIResponse(
-            success=False,
-            error=f"Failed to process image: {str(e)}"
-        )
+async def extract_info(image_data: ImageData, no_cache: bool = False, refine: bool = False):
+    """refine=true re-reads invalid or low-confidence fields from crops in one extra upstream call"""
+    return await process_extraction(image_data, use_cache=not no_cache, refine=refine)
+
+@app.post("/extract-info/stream")
+async def extract_info_stream(image_data: ImageData, no_cache: bool = False):
+    """Server-Sent Events: a `field` event per completed value (coerced, with its validation), then a `result` APIResponse"""
+    if image_data.card_type == CardType.auto:
+        raise HTTPException(status_code=400, detail="card_type=auto is not supported for streaming")
+    if not image_data.image_data:
+        raise HTTPException(status_code=400, detail="No image data provided")
+    with stage_timer("decode", image_data.card_type):
+        raw = decode_image(image_data.image_data)
+    events = await stream_extraction(raw, image_data.mime_type, image_data.card_type, use_cache=not no_cache)
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/extract-info/upload", response_model=APIResponse)
+async def extract_info_upload(
+    file: UploadFile = File(...),
+    card_type: CardType = Form(...),
+    no_cache: bool = False,
+    refine: bool = False,
+):
+    """multipart/form-data variant of /extract-info; avoids the base64 JSON overhead"""
+    with stage_timer("decode", card_type):
+        raw = await read_upload(file)
+    return await process_image(raw, file.content_type or "", card_type, use_cache=not no_cache, refine=refine)
+
+@app.post("/extract-info/raw", response_model=APIResponse)
+async def extract_info_raw(request: Request, card_type: CardType, no_cache: bool = False, refine: bool = False):
+    """Raw image bytes in the body; the MIME type comes from the Content-Type header"""
+    with stage_timer("decode", card_type):
+        raw = await read_limited(request)
+    return await process_image(
+        raw, request.headers.get("content-type", ""), card_type, use_cache=not no_cache, refine=refine
+    )
+
+async def failed_result(error: str) -> APIResponse:
+    return APIResponse(success=False, error=error)
+
+@app.post("/extract-batch", response_model=BatchResponse)
+async def extract_batch(batch: BatchRequest, request: Request, no_cache: bool = False, refine: bool = False):
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="No items provided")
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_ITEMS} items")
+    # The middleware charged one token; the rest of the batch is charged per item, capped so
+    # a batch larger than the burst can still be admitted once the bucket is full
+    await check_rate_limit(request, cost=min(len(batch.items), RATE_LIMIT_BURST) - 1)
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    def prepare(item: ImageData) -> Tuple[bytes, bytes]:
+        with stage_timer("decode", item.card_type):
+            raw = decode_image(item.image_data)
+        return raw, image_digest(raw)
+
+    async def run(raw: bytes, digest: bytes, item: ImageData) -> APIResponse:
+        async with semaphore:
+            try:
+                return await process_image(
+                    raw, item.mime_type, item.card_type, use_cache=not no_cache, refine=refine, digest=digest
+                )
+            except HTTPException as e:
+                return APIResponse(success=False, error=str(e.detail))
+            except Exception as e:
+                return APIResponse(success=False, error=f"Failed to process image: {str(e)}")
+
+    # Decoding and hashing every item is CPU work proportional to the batch; keep it off the event loop
+    prepared = await asyncio.gather(
+        *(asyncio.to_thread(prepare, item) for item in batch.items), return_exceptions=True
+    )
+    # Duplicate images within the batch share one extraction
+    tasks: Dict[tuple, asyncio.Task] = {}
+    ordered = []
+    for item, result in zip(batch.items, prepared):
+        if isinstance(result, HTTPException):
+            ordered.append(asyncio.ensure_future(failed_result(str(result.detail))))
+            continue
+        if isinstance(result, BaseException):
+            raise result
+        raw, digest = result
+        key = (digest, item.card_type)
+        if key not in tasks:
+            tasks[key] = asyncio.ensure_future(run(raw, digest, item))
+        ordered.append(tasks[key])
+    return BatchResponse(results=await asyncio.gather(*ordered))
+
+@app.post("/jobs", response_model=JobInfo, status_code=202)
+async def submit_job(request: JobRequest, response: Response):
+    if not request.image_data:
+        raise HTTPException(status_code=400, detail="No image data provided")
+    if request.callback_url:
+        await check_callback_url(request.callback_url)
+    job_id = await job_queue.submit(request)
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return await job_queue.get(job_id)
+
+@app.get("/jobs/stats")
+async def job_stats():
+    """Queue depth, capacity and age of the oldest queued job"""
+    return await job_queue.stats()
+
+@app.get("/jobs/{job_id}", response_model=JobInfo)
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/upstream/stats")
+async def upstream_stats():
+    """Per-model latency, token/cost usage, retry, circuit breaker and coalescing state"""
+    return {
+        **upstream.as_dict(),
+        "classifier": classifier_upstream.as_dict(),
+        "single_flight": single_flight.stats(),
+        "admission": admission.stats(),
+    }
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Result cache hit/miss counters"""
+    return result_cache.stats()
+
+@app.delete("/cache")
+async def clear_cache():
+    """Invalidate all cached extraction results"""
+    return {"cleared": await result_cache.clear()}
+
+metrics.register(CounterFunc("smartdoc_cache_hits_total", "Result cache hits", lambda: result_cache.hits))
+metrics.register(CounterFunc("smartdoc_cache_misses_total", "Result cache misses", lambda: result_cache.misses))
+metrics.register(Gauge("smartdoc_job_queue_depth", "Jobs waiting in the queue", job_queue.depth))
+metrics.register(CounterFunc(
+    "smartdoc_upstream_calls_saved_total", "Extractions served by a coalesced in-flight call", lambda: single_flight.coalesced))
+metrics.register(Gauge("smartdoc_upstream_active", "Upstream calls holding an admission slot", lambda: admission.active))
+metrics.register(Gauge("smartdoc_upstream_waiting", "Upstream calls waiting for an admission slot", lambda: admission.waiting))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus text exposition format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "driving-license-extractor"}
+    return {"status": "healthy", "service": "driving-license-extractor", "cold_start": COLD_START}
 
 @app.get("/extract-license-info")
 async def extract_license_info():
@@ -490,7 +3021,12 @@ async def extract_license_info():
         "description": "Upload a driving license image to extract information"
     }
 
-# Add this to run the app directly
-# Add this to run the app directly
+COLD_START["import_seconds"] = round(time.perf_counter() - _IMPORT_STARTED, 4)
+metrics.register(Gauge("smartdoc_import_seconds", "Module import time", lambda: COLD_START.get("import_seconds", 0)))
+metrics.register(Gauge("smartdoc_startup_seconds", "Lifespan startup time", lambda: COLD_START.get("startup_seconds", 0)))
+
+# Development server; use serve.py for multi-worker production runs
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(app, host="0.0.0.0", port=8102)
\ No newline at end of file
@@ -0,0 +1,334 @@
+"""End-to-end benchmark of /extract-info against the replay upstream, with a regression gate for CI.
+
+    python bench.py --concurrency 1,8,32 --requests 100 --baseline bench_baseline.json --update-baseline
+    python bench.py --concurrency 1,8,32 --requests 100 --baseline bench_baseline.json --threshold 0.2
+    python bench.py --concurrency 1,16 --requests 64 --latency fixed:0.5 --image-size 320x200 --min-scaling 0.6
+
+Starts upstream_stub.py in replay mode and the API via serve.py, then drives each card type at each
+concurrency level and reports p50/p95/p99 latency, throughput and peak server RSS. Without --recordings
+a synthetic recording per card type is generated, so no API key or network is needed. Exits 1 when a
+metric regresses past the threshold relative to the baseline, or when throughput at the highest
+concurrency falls below --min-scaling of linear scaling from the lowest.
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CARD_TYPES = ("driving_license", "pan_card", "aadhaar_card")
+
+# Plausible model replies for the synthetic recordings; every field validates
+SYNTHETIC_REPLIES = {
+    "driving_license": {"drivingLicense": {
+        "state": "MH", "dlNumber": "MH12 20110012345", "issueDate": "2020-01-05", "expiryDate": "2040-01-04",
+        "name": {"firstName": "Asha", "middleName": None, "lastName": "Patil"},
+        "address": {"street": "12 MG Road", "city": "Pune", "state": "MH", "zipCode": "411001"},
+        "sex": "F", "dateOfBirth": "1990-02-01", "restrictions": None, "endorsements": None,
+    }},
+    "pan_card": {"panCard": {
+        "panNumber": "ABCDE1234F", "name": {"firstName": "Asha", "middleName": None, "lastName": "Patil"},
+        "fatherName": "Ravi Patil", "dateOfBirth": "01/02/1990", "issueDate": None,
+    }},
+    "aadhaar_card": {"aadhaarCard": {
+        "aadhaarNumber": "2345 6789 0123", "name": "Asha Patil", "dateOfBirth": "01/02/1990", "gender": "F",
+        "address": {"house": "12", "street": "MG Road", "landmark": None, "city": "Pune", "state": "Maharashtra",
+                    "pinCode": "411001"},
+    }},
+}
+
+def write_synthetic_recordings(path: str):
+    # Built with the server's own payload builder so request keys match what it will send
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    from backk import CardType, build_openrouter_payload
+    from upstream_stub import request_key, strip_images
+
+    with open(path, "w") as f:
+        for card_type in CARD_TYPES:
+            payload = build_openrouter_payload(b"", "image/jpeg", CardType(card_type))
+            content = json.dumps(SYNTHETIC_REPLIES[card_type])
+            f.write(json.dumps({
+                "key": request_key(payload),
+                "request": strip_images(payload),
+                "status": 200,
+                "response": {
+                    "model": payload["model"],
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 900, "completion_tokens": len(content) // 4, "total_tokens": 900 + len(content) // 4},
+                },
+                "latency": 0.8,
+            }) + "\n")
+
+def sample_image(size) -> bytes:
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", size, (235, 228, 210))
+    draw = ImageDraw.Draw(image)
+    for y in range(40, size[1] - 40, 48):
+        draw.rectangle([40, y, size[0] - 40, y + 20], fill=(40, 40, 60))
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+def unique_images(base: bytes, count: int) -> List[str]:
+    """Base64 payloads that differ only in bytes after the image, so none are cached or coalesced"""
+    return [base64.b64encode(base + b"\0bench" + i.to_bytes(8, "big")).decode() for i in range(count)]
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def process_tree_rss(pid: int) -> int:
+    """Resident bytes of a process and its descendants (Linux /proc)"""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+async def wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+async def run_level(client: httpx.AsyncClient, card_type: str, images: List[str], concurrency: int, server_pid: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    peak_rss = 0
+    pending = iter(images)
+
+    async def worker():
+        nonlocal errors
+        for image in pending:
+            started = time.perf_counter()
+            try:
+                res = await client.post(
+                    "/extract-info",
+                    params={"no_cache": "true"},
+                    json={"image_data": image, "mime_type": "image/jpeg", "card_type": card_type},
+                )
+                ok = res.status_code == 200 and res.json().get("success")
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss, process_tree_rss(server_pid))
+            await asyncio.sleep(0.1)
+
+    sampler = asyncio.create_task(sample_rss())
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+    peak_rss = max(peak_rss, process_tree_rss(server_pid))
+    return {
+        "requests": len(images),
+        "error_rate": round(errors / len(images), 4),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "rss_mb": round(peak_rss / 2 ** 20, 1),
+    }
+
+async def run_benchmark(args, server_url: str, server_pid: int) -> Dict[str, dict]:
+    base = sample_image(tuple(int(v) for v in args.image_size.split("x")))
+    results = {}
+    # Connection limits are lifted so the client is never the bottleneck
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=server_url, timeout=120, limits=limits) as client:
+        if args.warmup:
+            await run_level(client, CARD_TYPES[0], unique_images(base, args.warmup), min(4, args.warmup), server_pid)
+        for card_type in args.card_types.split(","):
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                images = unique_images(base, max(args.requests, concurrency))
+                result = await run_level(client, card_type, images, concurrency, server_pid)
+                results[f"{card_type}@{concurrency}"] = result
+                print(
+                    f"{card_type:>16} c={concurrency:<4} p50={result['p50_ms']:>8.1f}ms p95={result['p95_ms']:>8.1f}ms "
+                    f"p99={result['p99_ms']:>8.1f}ms {result['throughput_rps']:>8.2f} req/s "
+                    f"rss={result['rss_mb']:>7.1f}MB errors={result['error_rate']:.2%}",
+                    file=sys.stderr,
+                )
+    return results
+
+# Metric -> True when larger is better
+GATED_METRICS = {"p50_ms": False, "p95_ms": False, "p99_ms": False, "throughput_rps": True, "rss_mb": False}
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float, min_delta_ms: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for metric, higher_is_better in GATED_METRICS.items():
+            old, new = reference.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (old - new) / old if higher_is_better else (new - old) / old
+            # Millisecond jitter on very fast levels is not a regression
+            if metric.endswith("_ms") and new - old < min_delta_ms:
+                continue
+            if change > threshold:
+                regressions.append(f"{name} {metric}: {old} -> {new} ({change:.0%} worse)")
+        if result["error_rate"] > reference.get("error_rate", 0) + 0.01:
+            regressions.append(f"{name} error_rate: {reference.get('error_rate', 0)} -> {result['error_rate']}")
+    return regressions
+
+def scaling(results: Dict[str, dict]) -> Dict[str, float]:
+    """Throughput at each card type's highest concurrency as a fraction of linear scaling from its lowest"""
+    levels: Dict[str, Dict[int, float]] = {}
+    for name, result in results.items():
+        card_type, concurrency = name.rsplit("@", 1)
+        levels.setdefault(card_type, {})[int(concurrency)] = result["throughput_rps"]
+    efficiency = {}
+    for card_type, throughput in levels.items():
+        low, high = min(throughput), max(throughput)
+        if high > low and throughput[low]:
+            efficiency[card_type] = round(throughput[high] / (throughput[low] * high / low), 3)
+    return efficiency
+
+def start_process(argv: List[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *argv], cwd=HERE, env={**os.environ, **env})
+
+def stop_process(proc: Optional[subprocess.Popen]):
+    if proc is None or proc.poll() is not None:
+        return
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recordings", help="Recordings from upstream_stub.py record (default: synthetic)")
+    parser.add_argument("--latency", default="lognormal:0.8,0.35", help="Upstream latency model, see upstream_stub.py")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Upstream error injection rate")
+    parser.add_argument("--card-types", default=",".join(CARD_TYPES))
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per card type and level")
+    parser.add_argument("--warmup", type=int, default=8)
+    parser.add_argument("--image-size", default="1600x1000", help="Synthetic image WxH")
+    parser.add_argument("--workers", type=int, default=1, help="API worker processes")
+    parser.add_argument("--output", help="Write results as JSON")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="Write results to --baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative regression per metric")
+    parser.add_argument("--min-delta-ms", type=float, default=10.0, help="Ignore latency changes smaller than this")
+    parser.add_argument("--min-scaling", type=float, default=0.0,
+                        help="Required throughput at the highest concurrency as a fraction of linear scaling")
+    args = parser.parse_args(argv)
+
+    stub = server = None
+    with tempfile.TemporaryDirectory() as tmp:
+        recordings = args.recordings
+        if recordings is None:
+            recordings = os.path.join(tmp, "recordings.jsonl")
+            write_synthetic_recordings(recordings)
+        stub_port, server_port = free_port(), free_port()
+        try:
+            stub = start_process(
+                ["upstream_stub.py", "replay", recordings, "--port", str(stub_port),
+                 "--latency", args.latency, "--error-rate", str(args.error_rate)],
+                {},
+            )
+            server = start_process(
+                ["serve.py", "--host", "127.0.0.1", "--port", str(server_port), "--workers", str(args.workers)],
+                {
+                    "OPENROUTER_BASE_URL": f"http://127.0.0.1:{stub_port}",
+                    "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "bench"),
+                    "RATE_LIMIT_ENABLED": "0",
+                    "JOB_DB": os.path.join(tmp, "jobs.db"),  # serve.py requires the shared store with --workers > 1
+                    "RESULT_CACHE_DB": "",
+                },
+            )
+            server_url = f"http://127.0.0.1:{server_port}"
+            asyncio.run(wait_ready(f"http://127.0.0.1:{stub_port}/stats"))
+            asyncio.run(wait_ready(f"{server_url}/health"))
+            results = asyncio.run(run_benchmark(args, server_url, server.pid))
+            stub_stats = httpx.get(f"http://127.0.0.1:{stub_port}/stats").json()
+        finally:
+            stop_process(server)
+            stop_process(stub)
+
+    if stub_stats.get("unmatched"):
+        print(f"Warning: {stub_stats['unmatched']} upstream requests matched no recording", file=sys.stderr)
+    efficiency = scaling(results)
+    for card_type, value in efficiency.items():
+        print(f"{card_type:>16} scaling efficiency {value:.0%}", file=sys.stderr)
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "update_baseline")},
+        "results": results,
+        "scaling": efficiency,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    poor_scaling = [card_type for card_type, value in efficiency.items() if value < args.min_scaling]
+    if poor_scaling:
+        print(f"Throughput does not scale with concurrency for: {', '.join(poor_scaling)}", file=sys.stderr)
+        return 1
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print("Performance regressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            return 1
+        print("No regressions against baseline", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""Fault-injection test of the upstream resilience layer against the replay upstream.
+
+    python fault_test.py
+    python fault_test.py --scenarios outage,slow_primary --requests 100
+
+Each scenario starts upstream_stub.py with injected faults and the API via serve.py with a primary and
+a fallback model, drives /extract-info and checks the outcome against /upstream/stats and the stub's
+per-model request counts:
+
+    transient        10% random 429/500/503: retries and fallback keep success near 100%, and
+                     above the same load with RETRY_MAX_ATTEMPTS=1 and no fallback
+    degraded         50% random errors: the retry budget caps upstream calls near
+                     requests * (1 + RETRY_BUDGET_RATIO) + RETRY_BUDGET_MIN instead of multiplying them
+    outage           primary always 503: every request succeeds on the fallback and the primary's
+                     circuit opens, so it stops receiving traffic
+    slow_primary     primary 3s slower than the fallback: hedging keeps p95 under the hedge delay plus
+                     the fallback's latency
+    client_error     primary always 400: requests fail fast, the circuit stays closed and the
+                     fallback is never tried
+
+Exits 1 when any check fails.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import httpx
+
+from bench import (
+    free_port, percentile, sample_image, start_process, stop_process, unique_images, wait_ready,
+    write_synthetic_recordings,
+)
+
+PRIMARY, FALLBACK = "test/primary", "test/fallback"
+UPSTREAM_LATENCY = 0.2
+RESILIENT_ENV = {
+    "OPENROUTER_MODEL": PRIMARY,
+    "OPENROUTER_FALLBACK_MODELS": FALLBACK,
+    "RETRY_BASE_DELAY": "0.05",
+    "RETRY_MAX_DELAY": "0.5",
+    "CIRCUIT_FAILURE_THRESHOLD": "5",
+    "CIRCUIT_RESET_TIMEOUT": "60",
+    "RETRY_BUDGET_RATIO": "0.2",
+    "RETRY_BUDGET_MIN": "10",
+}
+
+async def drive(server_url: str, requests: int, concurrency: int) -> Tuple[List[float], Dict[int, int]]:
+    """Latencies of successful extractions and a count of failures by HTTP status"""
+    images = unique_images(sample_image((320, 200)), requests)
+    pending = iter(images)
+    latencies: List[float] = []
+    failures: Dict[int, int] = {}
+
+    async def worker(client: httpx.AsyncClient):
+        for image in pending:
+            started = time.perf_counter()
+            try:
+                res = await client.post(
+                    "/extract-info",
+                    params={"no_cache": "true"},
+                    json={"image_data": image, "mime_type": "image/jpeg", "card_type": "pan_card"},
+                )
+                status = res.status_code if res.status_code != 200 or res.json().get("success") else 0
+            except httpx.HTTPError:
+                status = -1
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                failures[status] = failures.get(status, 0) + 1
+
+    async with httpx.AsyncClient(base_url=server_url, timeout=120) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return latencies, failures
+
+def run(recordings: str, stub_args: List[str], server_env: Dict[str, str], requests: int, concurrency: int) -> dict:
+    stub_port, server_port = free_port(), free_port()
+    stub = server = None
+    try:
+        stub = start_process(["upstream_stub.py", "replay", recordings, "--port", str(stub_port),
+                              "--latency", f"fixed:{UPSTREAM_LATENCY}", *stub_args], {})
+        server = start_process(
+            ["serve.py", "--host", "127.0.0.1", "--port", str(server_port), "--workers", "1"],
+            {
+                "OPENROUTER_BASE_URL": f"http://127.0.0.1:{stub_port}",
+                "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "fault-test"),
+                "RATE_LIMIT_ENABLED": "0",
+                "RESULT_CACHE_DB": "",
+                **server_env,
+            },
+        )
+        server_url = f"http://127.0.0.1:{server_port}"
+        asyncio.run(wait_ready(f"http://127.0.0.1:{stub_port}/stats"))
+        asyncio.run(wait_ready(f"{server_url}/health"))
+        latencies, failures = asyncio.run(drive(server_url, requests, concurrency))
+        stub_stats = httpx.get(f"http://127.0.0.1:{stub_port}/stats").json()
+        upstream_stats = httpx.get(f"{server_url}/upstream/stats").json()
+    finally:
+        stop_process(server)
+        stop_process(stub)
+    return {
+        "success_rate": len(latencies) / requests,
+        "p95_s": percentile(latencies, 0.95),
+        "failures": failures,
+        "calls": {model: stub_stats.get(f"model:{model}", 0) for model in (PRIMARY, FALLBACK)},
+        "models": upstream_stats["models"],
+    }
+
+def transient(recordings: str, args) -> List[Tuple[str, bool]]:
+    faults = ["--error-rate", "0.1"]
+    plain = run(recordings, faults, {"OPENROUTER_MODEL": PRIMARY, "RETRY_MAX_ATTEMPTS": "1"}, args.requests, args.concurrency)
+    resilient = run(recordings, faults, RESILIENT_ENV, args.requests, args.concurrency)
+    print(f"  success without retries/fallback {plain['success_rate']:.1%}, with {resilient['success_rate']:.1%}; "
+          f"upstream calls {sum(resilient['calls'].values())} for {args.requests} requests", file=sys.stderr)
+    return [
+        ("resilient success rate >= 97%", resilient["success_rate"] >= 0.97),
+        ("resilience beats a single attempt", resilient["success_rate"] > plain["success_rate"]),
+    ]
+
+def degraded(recordings: str, args) -> List[Tuple[str, bool]]:
+    result = run(recordings, ["--error-rate", "0.5"], RESILIENT_ENV, args.requests, args.concurrency)
+    calls = sum(result["calls"].values())
+    # Budget plus calls already in flight when it runs dry, and free failovers as each circuit opens
+    allowed = int(args.requests * (1 + float(RESILIENT_ENV["RETRY_BUDGET_RATIO"]))
+                  + float(RESILIENT_ENV["RETRY_BUDGET_MIN"]) + args.concurrency * 3)
+    print(f"  success {result['success_rate']:.1%}, upstream calls {calls} for {args.requests} requests", file=sys.stderr)
+    return [(f"upstream calls <= {allowed}", calls <= allowed)]
+
+def outage(recordings: str, args) -> List[Tuple[str, bool]]:
+    result = run(recordings, ["--model-faults", f"{PRIMARY}=503"], RESILIENT_ENV, args.requests, args.concurrency)
+    primary = result["models"][PRIMARY]
+    print(f"  success {result['success_rate']:.1%}, primary circuit {primary['circuit']}, "
+          f"upstream calls {result['calls']}", file=sys.stderr)
+    # Concurrent calls already in flight when the circuit opens may still reach the primary
+    allowed = int(RESILIENT_ENV["CIRCUIT_FAILURE_THRESHOLD"]) + args.concurrency
+    return [
+        ("every request succeeds on the fallback", result["success_rate"] == 1.0),
+        ("primary circuit is open", primary["circuit"] == "open"),
+        (f"primary receives at most {allowed} calls", result["calls"][PRIMARY] <= allowed),
+    ]
+
+def slow_primary(recordings: str, args) -> List[Tuple[str, bool]]:
+    hedge_delay = 0.5
+    result = run(
+        recordings,
+        ["--model-latency", f"{PRIMARY}=3"],
+        {**RESILIENT_ENV, "HEDGE_ENABLED": "1", "HEDGE_DELAY": str(hedge_delay)},
+        args.requests,
+        args.concurrency,
+    )
+    limit = hedge_delay + UPSTREAM_LATENCY + 0.5
+    hedges = result["models"][FALLBACK]["hedges"]
+    print(f"  success {result['success_rate']:.1%}, p95 {result['p95_s']:.2f}s, hedges {hedges}", file=sys.stderr)
+    return [
+        ("every request succeeds", result["success_rate"] == 1.0),
+        ("every request is hedged to the fallback", hedges == args.requests),
+        (f"p95 under {limit:.1f}s despite a 3s primary", result["p95_s"] < limit),
+    ]
+
+def client_error(recordings: str, args) -> List[Tuple[str, bool]]:
+    result = run(recordings, ["--model-faults", f"{PRIMARY}=400"], RESILIENT_ENV, args.requests, args.concurrency)
+    primary = result["models"][PRIMARY]
+    print(f"  failures {result['failures']}, primary circuit {primary['circuit']}, "
+          f"upstream calls {result['calls']}", file=sys.stderr)
+    return [
+        ("every request fails with the upstream 400", result["failures"] == {400: args.requests}),
+        ("one upstream call per request", result["calls"][PRIMARY] == args.requests),
+        ("fallback is never tried", result["calls"][FALLBACK] == 0),
+        ("primary circuit stays closed", primary["circuit"] == "closed"),
+    ]
+
+SCENARIOS = {"transient": transient, "degraded": degraded, "outage": outage, "slow_primary": slow_primary, "client_error": client_error}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=60, help="Requests per run")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    failed = []
+    with tempfile.TemporaryDirectory() as tmp:
+        recordings = os.path.join(tmp, "recordings.jsonl")
+        write_synthetic_recordings(recordings)
+        for name in args.scenarios.split(","):
+            print(name, file=sys.stderr)
+            for check, ok in SCENARIOS[name](recordings, args):
+                print(f"  {'ok  ' if ok else 'FAIL'} {check}", file=sys.stderr)
+                if not ok:
+                    failed.append(f"{name}: {check}")
+    if failed:
+        print("Failed checks:\n  " + "\n  ".join(failed), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
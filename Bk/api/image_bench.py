@@ -0,0 +1,138 @@
+"""Benchmark of the upload normalization stage: payload size, image tokens and latency per image.
+
+    python image_bench.py                              # synthetic phone-photo corpus
+    python image_bench.py --corpus ~/card-photos --uplink-mbps 10 --output image_bench.json
+
+Runs normalize_image on every image of the corpus and reports original vs normalized bytes, the base64
+data: URL size sent upstream, estimated image tokens (OpenAI high-detail tile formula) and the time
+normalization takes against the upload time it saves at the given uplink bandwidth.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import sys
+import time
+from typing import List, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+MIME_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}
+
+# Typical phone camera outputs: (width, height, EXIF orientation)
+SYNTHETIC_CORPUS = [(4032, 3024, 6), (4000, 3000, 1), (3264, 2448, 8), (2592, 1944, 1), (1600, 1000, 1)]
+
+def synthetic_photo(width: int, height: int, orientation: int, seed: int) -> bytes:
+    """A card-like photo with sensor noise, so it compresses like a real one (several MB at 12MP)"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    noise = Image.effect_noise((width, height), 64).convert("RGB")
+    image = Image.blend(Image.new("RGB", (width, height), (205, 198, 180)), noise, 0.5)
+    draw = ImageDraw.Draw(image)
+    margin = width // 10
+    draw.rectangle([margin, margin, width - margin, height - margin], fill=(236, 230, 214))
+    for y in range(margin * 2, height - margin * 2, max(24, height // 30)):
+        draw.rectangle([margin * 2, y, margin * 2 + rng.randint(width // 5, width // 2), y + height // 80],
+                       fill=(40, 40, 60))
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=95, exif=exif)
+    return buf.getvalue()
+
+def load_corpus(path: str) -> List[Tuple[str, bytes, str]]:
+    images = []
+    for name in sorted(os.listdir(path)):
+        ext = os.path.splitext(name)[1].lower()
+        if ext in IMAGE_EXTENSIONS:
+            with open(os.path.join(path, name), "rb") as f:
+                images.append((name, f.read(), MIME_TYPES[ext]))
+    return images
+
+def image_tokens(width: int, height: int) -> int:
+    """OpenAI high-detail estimate: fit in 2048x2048, shortest side to 768, 170 tokens per 512px tile plus 85"""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+def data_url_bytes(size: int) -> int:
+    return 4 * math.ceil(size / 3)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="Directory of sample images (default: synthetic phone photos)")
+    parser.add_argument("--uplink-mbps", type=float, default=20.0, help="Bandwidth used to estimate upload time")
+    parser.add_argument("--repeat", type=int, default=3, help="Normalization runs per image; the fastest counts")
+    parser.add_argument("--output", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("OPENAI_API_KEY", "image-bench")
+    sys.path.insert(0, HERE)
+    from backk import normalize_image
+
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        corpus = [(f"synthetic-{w}x{h}-o{o}.jpg", synthetic_photo(w, h, o, i), "image/jpeg")
+                  for i, (w, h, o) in enumerate(SYNTHETIC_CORPUS)]
+    if not corpus:
+        parser.error(f"No images found in {args.corpus}")
+
+    bytes_per_ms = args.uplink_mbps * 1e6 / 8 / 1000
+    rows = []
+    for name, raw, mime_type in corpus:
+        elapsed = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            encoded, _, report = normalize_image(raw, mime_type)
+            elapsed.append((time.perf_counter() - started) * 1000)
+        before, after = data_url_bytes(len(raw)), data_url_bytes(len(encoded))
+        row = {
+            "image": name,
+            "original_bytes": len(raw),
+            "original_size": report["original_size"],
+            "bytes": len(encoded),
+            "size": report["size"],
+            "payload_bytes_before": before,
+            "payload_bytes_after": after,
+            "tokens_before": image_tokens(*report["original_size"]),
+            "tokens_after": image_tokens(*report["size"]),
+            "normalize_ms": round(min(elapsed), 1),
+            "upload_ms_saved": round((before - after) / bytes_per_ms, 1),
+        }
+        rows.append(row)
+        print(
+            f"{name:>32} {row['original_bytes'] / 2 ** 20:6.2f}MB -> {row['bytes'] / 2 ** 20:6.2f}MB "
+            f"({1 - row['bytes'] / row['original_bytes']:5.1%} smaller) tokens {row['tokens_before']}->{row['tokens_after']} "
+            f"normalize {row['normalize_ms']:7.1f}ms, upload saved {row['upload_ms_saved']:8.1f}ms",
+            file=sys.stderr,
+        )
+
+    total_before = sum(r["payload_bytes_before"] for r in rows)
+    total_after = sum(r["payload_bytes_after"] for r in rows)
+    summary = {
+        "images": len(rows),
+        "payload_reduction": round(1 - total_after / total_before, 3),
+        "normalize_ms_total": round(sum(r["normalize_ms"] for r in rows), 1),
+        "upload_ms_saved_total": round(sum(r["upload_ms_saved"] for r in rows), 1),
+        "tokens_before": sum(r["tokens_before"] for r in rows),
+        "tokens_after": sum(r["tokens_after"] for r in rows),
+    }
+    print(
+        f"payload {total_before / 2 ** 20:.1f}MB -> {total_after / 2 ** 20:.1f}MB ({summary['payload_reduction']:.1%} smaller), "
+        f"normalization {summary['normalize_ms_total']:.0f}ms vs {summary['upload_ms_saved_total']:.0f}ms upload saved "
+        f"at {args.uplink_mbps:g} Mbit/s, image tokens {summary['tokens_before']} -> {summary['tokens_after']}",
+        file=sys.stderr,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "summary": summary, "images": rows}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
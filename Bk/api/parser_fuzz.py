@@ -0,0 +1,220 @@
+"""Fuzz and benchmark of the model-output parser against the fence-stripping parser it replaced.
+
+    python parser_fuzz.py --samples 20000
+    python parser_fuzz.py --recordings recordings.jsonl --samples 50000 --seed 7
+
+Takes model replies from upstream_stub.py recordings (or the synthetic replies bench.py uses), applies
+the defects seen in practice (fences, prose, trailing commas, single quotes, Python literals,
+sentinels, a dropped card wrapper, truncation at max_tokens) alone and combined, and reports per
+defect how often each parser returns an object. Every reply the old parser rejected became a 422
+and a client retry of the whole vision call. Lossless defects must parse back to exactly the clean
+reply's data (sentinels to null), and anything unparseable must raise JSONDecodeError; the script
+exits 1 otherwise.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def reference_parse(response_text: str) -> dict:
+    """The parser before the tolerant one: strip a leading fence by fixed slicing, then json.loads"""
+    response_text = response_text.strip()
+    if response_text.startswith('```json'):
+        response_text = response_text[7:-3]
+    elif response_text.startswith('```'):
+        response_text = response_text[3:-3]
+    return json.loads(response_text)
+
+def load_replies(path: str) -> List[str]:
+    replies = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                response = json.loads(line)["response"]
+                replies.append(response["choices"][0]["message"]["content"])
+    return replies
+
+def _set_random_leaf(data: dict, rng: random.Random, value):
+    node = data
+    while True:
+        keys = list(node)
+        if not keys:
+            return
+        key = rng.choice(keys)
+        if isinstance(node[key], dict) and node[key]:
+            node = node[key]
+            continue
+        node[key] = value
+        return
+
+# Defect name -> (mutate(text, rng) -> text, lossless)
+def fence_json(text, rng):
+    return f"```json\n{text}\n```"
+
+def fence_trailing_prose(text, rng):
+    return f"```json\n{text}\n```\nLet me know if you need anything else."
+
+def prose_before(text, rng):
+    return f"Here is the extracted information:\n\n{text}"
+
+def trailing_commas(text, rng):
+    return text.replace("}", ",}").replace("]", ",]").replace("{,}", "{}").replace("[,]", "[]")
+
+def single_quotes(text, rng):
+    return text.replace("'", "\\'").replace('"', "'")
+
+def python_literals(text, rng):
+    return text.replace("null", "None").replace("true", "True").replace("false", "False")
+
+SENTINELS = ["Not detected", "N/A", "not visible", "-"]
+
+def sentinel(text, rng):
+    mutated = json.loads(text)
+    _set_random_leaf(mutated, rng, rng.choice(SENTINELS))
+    return json.dumps(mutated)
+
+def without_sentinels(text: str) -> str:
+    """The reply a model following the prompt would have sent: null instead of a sentinel"""
+    for value in SENTINELS:
+        text = text.replace(json.dumps(value), "null")
+    return text
+
+def dropped_wrapper(text, rng):
+    return json.dumps(next(iter(json.loads(text).values())))
+
+def truncated(text, rng):
+    return text[:rng.randint(text.find("{") + 1, len(text) - 1)]
+
+DEFECTS: Dict[str, Tuple[Callable, bool]] = {
+    "fence_json": (fence_json, True),
+    "fence_trailing_prose": (fence_trailing_prose, True),
+    "prose_before": (prose_before, True),
+    "trailing_commas": (trailing_commas, True),
+    "single_quotes": (single_quotes, True),
+    "python_literals": (python_literals, True),
+    "sentinel": (sentinel, True),
+    "dropped_wrapper": (dropped_wrapper, True),
+    "truncated": (truncated, False),
+}
+
+def mutate(name: str, text: str, rng: random.Random) -> Tuple[str, bool]:
+    if name != "combined":
+        fn, lossless = DEFECTS[name]
+        return fn(text, rng), lossless
+    # Two text-level defects, on top of a truncation half of the time
+    chosen = rng.sample(["fence_json", "prose_before", "trailing_commas", "single_quotes", "python_literals"], 2)
+    lossless = True
+    if rng.random() < 0.5:
+        text, lossless = truncated(text, rng), False
+    for defect in chosen:
+        text = DEFECTS[defect][0](text, rng)
+    return text, lossless
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recordings", help="Recordings from upstream_stub.py record (default: synthetic replies)")
+    parser.add_argument("--samples", type=int, default=20000, help="Mutated replies, spread over the defects")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("OPENAI_API_KEY", "parser-fuzz")
+    sys.path.insert(0, HERE)
+    from backk import CARD_KEYS, parse_model_output
+    from bench import SYNTHETIC_REPLIES
+
+    key_to_card = {key: card_type for card_type, key in CARD_KEYS.items()}
+    if args.recordings:
+        replies = load_replies(args.recordings)
+    else:
+        replies = [json.dumps(reply) for reply in SYNTHETIC_REPLIES.values()]
+    corpus = []
+    for reply in replies:
+        clean = reference_parse(reply)
+        card_type = key_to_card[next(iter(clean))]
+        corpus.append((json.dumps(clean), card_type, parse_model_output(reply, card_type)))
+
+    rng = random.Random(args.seed)
+    names = list(DEFECTS) + ["combined"]
+    counts = {name: {"samples": 0, "reference": 0, "parsed": 0, "exact": 0} for name in names}
+    samples: List[Tuple[str, object]] = []
+    problems = []
+    whole = partial = 0  # Replies the old parser rejected that now parse completely or in part
+    for i in range(args.samples):
+        name = names[i % len(names)]
+        text, card_type, expected = rng.choice(corpus)
+        mutated, lossless = mutate(name, text, rng)
+        samples.append((mutated, card_type))
+        row = counts[name]
+        row["samples"] += 1
+        try:
+            reference_parse(mutated)
+            row["reference"] += 1
+            rejected = False
+        except ValueError:
+            rejected = True
+        try:
+            result = parse_model_output(mutated, card_type)
+        except ValueError:
+            if lossless:
+                problems.append(f"{name}: lossless defect not recovered: {mutated[:120]!r}")
+            continue
+        except Exception as e:
+            problems.append(f"{name}: {type(e).__name__} instead of JSONDecodeError: {mutated[:120]!r}")
+            continue
+        row["parsed"] += 1
+        if name == "sentinel":
+            expected = parse_model_output(without_sentinels(mutated), card_type)
+        if result == expected:
+            row["exact"] += 1
+            whole += rejected
+        else:
+            partial += rejected
+        if result != expected and lossless:
+            problems.append(f"{name}: parsed to different data: {mutated[:120]!r}")
+
+    # Arbitrary text must fail cleanly, never crash
+    alphabet = "{}[]\"':,.-0123456789 \nabcNoneTruefalsenull`"
+    for _ in range(args.samples // 10):
+        garbage = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 80)))
+        try:
+            parse_model_output(garbage)
+        except ValueError:
+            pass
+        except Exception as e:
+            problems.append(f"garbage: {type(e).__name__}: {garbage!r}")
+
+    print(f"{'defect':>22} {'samples':>8} {'old parser':>11} {'new parser':>11} {'exact':>8}", file=sys.stderr)
+    totals = {"samples": 0, "reference": 0, "parsed": 0}
+    for name, row in counts.items():
+        for key in totals:
+            totals[key] += row[key]
+        n = row["samples"] or 1
+        print(f"{name:>22} {row['samples']:>8} {row['reference'] / n:>11.1%} {row['parsed'] / n:>11.1%} "
+              f"{row['exact'] / n:>8.1%}", file=sys.stderr)
+    rejected = totals["samples"] - totals["reference"]
+    print(f"old parser rejected {rejected} of {totals['samples']} replies (each a 422 and a retried vision call); "
+          f"the new parser recovers {whole} ({whole / max(rejected, 1):.1%}) completely and {partial} "
+          f"({partial / max(rejected, 1):.1%}) in part, from truncated replies", file=sys.stderr)
+
+    for parse in (reference_parse, lambda text: parse_model_output(text)):
+        started = time.perf_counter()
+        for mutated, _ in samples:
+            try:
+                parse(mutated)
+            except ValueError:
+                pass
+        label = "old" if parse is reference_parse else "new"
+        print(f"{label} parser: {(time.perf_counter() - started) / len(samples) * 1e6:.1f}us per reply", file=sys.stderr)
+
+    if problems:
+        print(f"{len(problems)} problems:\n  " + "\n  ".join(problems[:20]), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""Re-run coerce_types and card validation over stored APIResponse JSONL without new model calls.
+
+    python revalidate.py responses.jsonl revalidated.jsonl --workers 8 --resume
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from backk import CARD_KEYS, coerce_types, validate_card_fields
+
+CARD_TYPES_BY_KEY = {key: card_type for card_type, key in CARD_KEYS.items()}
+
+def revalidate_record(record: dict) -> dict:
+    data = record.get("data")
+    if not record.get("success") or not isinstance(data, dict):
+        return record
+    card_keys = [key for key in CARD_TYPES_BY_KEY if data.get(key) is not None]
+    if not card_keys:
+        return record
+    # auto-detected images can carry several cards; validation merges them as process_auto does
+    validation = {}
+    for card_key in card_keys:
+        card = coerce_types({card_key: data[card_key]})
+        record["data"] = {**record["data"], card_key: card[card_key]}
+        validation.update(validate_card_fields(CARD_TYPES_BY_KEY[card_key], card))
+    record["validation"] = validation
+    return record
+
+def revalidate_chunk(lines: List[bytes]) -> Tuple[bytes, int, int]:
+    """Returns (output bytes, records written, records that failed to parse)"""
+    out = []
+    errors = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = revalidate_record(json.loads(line))
+        except (ValueError, TypeError, AttributeError) as e:
+            errors += 1
+            record = {"success": False, "error": f"Revalidation failed: {str(e)}", "raw": line.decode(errors="replace")}
+        out.append(json.dumps(record, ensure_ascii=False))
+    return ("\n".join(out) + "\n").encode() if out else b"", len(out), errors
+
+def read_chunks(f, chunk_size: int):
+    """Yield (lines, end_offset) so progress can be checkpointed on chunk boundaries"""
+    lines = []
+    for line in f:
+        lines.append(line)
+        if len(lines) >= chunk_size:
+            yield lines, f.tell()
+            lines = []
+    if lines:
+        yield lines, f.tell()
+
+def load_checkpoint(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"input_offset": 0, "output_offset": 0, "records": 0, "errors": 0}
+
+def save_checkpoint(path: str, state: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="JSONL/NDJSON file of stored APIResponse payloads")
+    parser.add_argument("output", help="Where to write revalidated records")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=2000, help="Records per work unit")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.ckpt)")
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint offset")
+    args = parser.parse_args(argv)
+
+    checkpoint = args.checkpoint or args.output + ".ckpt"
+    state = load_checkpoint(checkpoint) if args.resume else load_checkpoint(os.devnull)
+    # At most this many chunks are buffered, which bounds memory regardless of file size
+    max_in_flight = args.workers * 2
+    started = time.perf_counter()
+    processed = 0
+
+    with open(args.input, "rb") as src, open(args.output, "r+b" if args.resume and os.path.exists(args.output) else "wb") as dst:
+        src.seek(state["input_offset"])
+        dst.seek(state["output_offset"])
+        dst.truncate()
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            pending = deque()
+
+            def drain_one():
+                nonlocal processed
+                future, end_offset = pending.popleft()
+                data, written, errors = future.result()
+                dst.write(data)
+                dst.flush()
+                processed += written
+                state.update(
+                    input_offset=end_offset,
+                    output_offset=dst.tell(),
+                    records=state["records"] + written,
+                    errors=state["errors"] + errors,
+                )
+                save_checkpoint(checkpoint, state)
+                elapsed = time.perf_counter() - started
+                print(f"\r{state['records']} records, {processed / elapsed:,.0f} records/s", end="", file=sys.stderr)
+
+            for lines, end_offset in read_chunks(src, args.chunk_size):
+                pending.append((pool.submit(revalidate_chunk, lines), end_offset))
+                while len(pending) >= max_in_flight:
+                    drain_one()
+            while pending:
+                drain_one()
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"\nDone: {state['records']} records ({state['errors']} unparseable) in {elapsed:.2f}s, "
+        f"{processed / elapsed if elapsed else 0:,.0f} records/s",
+        file=sys.stderr,
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Production launcher: N workers across cores with graceful shutdown.
+
+    python serve.py --workers 4 --port 8102
+
+Uses gunicorn with uvicorn workers and a preloaded app when gunicorn is installed
+(the module is imported once in the master and forked), otherwise uvicorn's own
+process manager. Settings can also come from the environment (WEB_CONCURRENCY, PORT, ...).
+
+Workers share nothing in memory, so with more than one worker the job store defaults to SQLite
+(JOB_STORE=sqlite); otherwise a job polled on a different worker than it was submitted to is a 404.
+"""
+import argparse
+import math
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+GRACEFUL_MARGIN = 5  # Seconds beyond the app's shutdown drain for closing connections
+
+def build_parser():
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description="Run the SmartDoc API with multiple workers")
+    parser.add_argument("--host", default=env("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(env("PORT", "8102")))
+    parser.add_argument("--workers", type=int, default=int(env("WEB_CONCURRENCY", str(os.cpu_count() or 1))))
+    parser.add_argument("--keep-alive", type=int, default=int(env("KEEP_ALIVE", "5")),
+                        help="Seconds to hold idle keep-alive connections")
+    parser.add_argument("--limit-concurrency", type=int, default=int(env("LIMIT_CONCURRENCY", "0")) or None,
+                        help="Per-worker cap on concurrent connections before 503s")
+    parser.add_argument("--max-requests", type=int, default=int(env("MAX_REQUESTS", "0")) or None,
+                        help="Recycle a worker after this many requests")
+    parser.add_argument("--backlog", type=int, default=int(env("BACKLOG", "2048")))
+    parser.add_argument("--graceful-timeout", type=int, default=int(env("GRACEFUL_TIMEOUT", "0")) or None,
+                        help="Seconds to drain in-flight requests on shutdown "
+                             f"(default: SHUTDOWN_DRAIN_TIMEOUT + {GRACEFUL_MARGIN})")
+    parser.add_argument("--no-preload", action="store_true", help="Use uvicorn workers even if gunicorn is available")
+    return parser
+
+def configure_graceful_timeout(parser, args):
+    # The app's shutdown drain runs inside the graceful timeout; a worker still draining when it ends is killed
+    drain = math.ceil(float(os.environ.get("SHUTDOWN_DRAIN_TIMEOUT", "25")))
+    if args.graceful_timeout is None:
+        args.graceful_timeout = drain + GRACEFUL_MARGIN
+    elif args.graceful_timeout <= drain:
+        parser.error(f"--graceful-timeout {args.graceful_timeout} must exceed SHUTDOWN_DRAIN_TIMEOUT ({drain}s)")
+
+def configure_job_store(parser, args):
+    if args.workers <= 1:
+        return
+    job_store = os.environ.setdefault("JOB_STORE", "sqlite")
+    if job_store != "sqlite":
+        parser.error(f"JOB_STORE={job_store} keeps jobs per process; use JOB_STORE=sqlite or --workers 1")
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+    from uvicorn.workers import UvicornWorker
+
+    class Worker(UvicornWorker):
+        # gunicorn's worker_connections is not read by UvicornWorker; uvicorn needs limit_concurrency itself
+        CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "limit_concurrency": args.limit_concurrency}
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in {
+                "bind": f"{args.host}:{args.port}",
+                "workers": args.workers,
+                "worker_class": Worker,
+                "preload_app": True,
+                "keepalive": args.keep_alive,
+                "backlog": args.backlog,
+                "graceful_timeout": args.graceful_timeout,
+                "timeout": max(120, args.graceful_timeout),
+                "max_requests": args.max_requests or 0,
+                "max_requests_jitter": (args.max_requests or 0) // 10,
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from backk import app
+            return app
+
+    Application().run()
+
+def run_uvicorn(args):
+    import uvicorn
+
+    uvicorn.run(
+        "backk:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_keep_alive=args.keep_alive,
+        limit_concurrency=args.limit_concurrency,
+        limit_max_requests=args.max_requests,
+        backlog=args.backlog,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=True,
+    )
+
+def main(argv=None):
+    # Same .env the app loads, so JOB_STORE set there is seen before workers start
+    load_dotenv(Path(__file__).resolve().parent / ".env")
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    configure_job_store(parser, args)
+    configure_graceful_timeout(parser, args)
+    if not args.no_preload:
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            pass
+        else:
+            return run_gunicorn(args)
+    run_uvicorn(args)
+
+if __name__ == "__main__":
+    main()
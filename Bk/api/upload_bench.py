@@ -0,0 +1,156 @@
+"""Memory and latency benchmark of the base64 JSON, multipart and raw-bytes upload paths.
+
+    python upload_bench.py --sizes-mb 1,5,10 --concurrency 8 --requests 32
+
+For each upload path and image size, starts a fresh API (serve.py) against the replay upstream and
+sends concurrent extractions, reporting p50/p95 latency, throughput and the server's peak RSS above
+idle. Images are a small JPEG padded to the target size, so decoding cost stays constant and the
+numbers reflect how each path carries the bytes.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import httpx
+
+from bench import (
+    free_port, percentile, process_tree_rss, sample_image, start_process, stop_process, wait_ready,
+    write_synthetic_recordings,
+)
+
+MODES = ("json", "multipart", "raw")
+CARD_TYPE = "driving_license"
+
+def make_sender(mode: str, size: int) -> Callable[[httpx.AsyncClient, int], "asyncio.Future"]:
+    """Builds per-request bodies cheaply: a shared padded image plus a unique 9-byte suffix"""
+    base = sample_image((320, 200))
+    pad = max(0, size - len(base) - 9)
+    pad -= (len(base) + pad) % 3  # Keeps the prefix's base64 concatenable with the suffix's
+    prefix = base + os.urandom(pad)
+    encoded_prefix = base64.b64encode(prefix)
+    params = {"no_cache": "true"}
+
+    async def send(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        suffix = b"\0" + i.to_bytes(8, "big")
+        if mode == "json":
+            body = b"".join([
+                b'{"image_data": "', encoded_prefix, base64.b64encode(suffix),
+                b'", "mime_type": "image/jpeg", "card_type": "', CARD_TYPE.encode(), b'"}',
+            ])
+            return await client.post("/extract-info", params=params, content=body,
+                                      headers={"content-type": "application/json"})
+        if mode == "multipart":
+            return await client.post("/extract-info/upload", params=params, data={"card_type": CARD_TYPE},
+                                      files={"file": ("card.jpg", prefix + suffix, "image/jpeg")})
+        return await client.post("/extract-info/raw", params={**params, "card_type": CARD_TYPE},
+                                  content=prefix + suffix, headers={"content-type": "image/jpeg"})
+
+    return send
+
+async def run_case(server_url: str, server_pid: int, mode: str, size: int, concurrency: int, requests: int) -> dict:
+    send = make_sender(mode, size)
+    latencies: List[float] = []
+    errors = 0
+    pending = iter(range(requests))
+    idle_rss = peak_rss = process_tree_rss(server_pid)
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        for i in pending:
+            started = time.perf_counter()
+            try:
+                res = await send(client, i)
+                ok = res.status_code == 200 and res.json().get("success")
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss, process_tree_rss(server_pid))
+            await asyncio.sleep(0.05)
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=server_url, timeout=120, limits=limits) as client:
+        sampler = asyncio.create_task(sample_rss())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "idle_rss_mb": round(idle_rss / 2 ** 20, 1),
+        "peak_rss_over_idle_mb": round((peak_rss - idle_rss) / 2 ** 20, 1),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--sizes-mb", default="1,5,10", help="Comma-separated image sizes in MB")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=32, help="Requests per mode and size")
+    parser.add_argument("--latency", default="fixed:0.2", help="Upstream latency model, see upstream_stub.py")
+    parser.add_argument("--output", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    results: Dict[str, dict] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        recordings = os.path.join(tmp, "recordings.jsonl")
+        write_synthetic_recordings(recordings)
+        stub_port = free_port()
+        stub = start_process(["upstream_stub.py", "replay", recordings, "--port", str(stub_port),
+                              "--latency", args.latency], {})
+        try:
+            asyncio.run(wait_ready(f"http://127.0.0.1:{stub_port}/stats"))
+            for size_mb in (float(s) for s in args.sizes_mb.split(",")):
+                for mode in args.modes.split(","):
+                    # A fresh server per case, since freed memory is not returned to the OS
+                    server_port = free_port()
+                    server = start_process(
+                        ["serve.py", "--host", "127.0.0.1", "--port", str(server_port), "--workers", "1"],
+                        {
+                            "OPENROUTER_BASE_URL": f"http://127.0.0.1:{stub_port}",
+                            "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "bench"),
+                            "RATE_LIMIT_ENABLED": "0",
+                            "RESULT_CACHE_DB": "",
+                        },
+                    )
+                    try:
+                        server_url = f"http://127.0.0.1:{server_port}"
+                        asyncio.run(wait_ready(f"{server_url}/health"))
+                        result = asyncio.run(run_case(
+                            server_url, server.pid, mode, int(size_mb * 2 ** 20), args.concurrency, args.requests
+                        ))
+                    finally:
+                        stop_process(server)
+                    results[f"{mode}@{size_mb:g}MB"] = result
+                    print(
+                        f"{mode:>9} {size_mb:>4g}MB p50={result['p50_ms']:>8.1f}ms p95={result['p95_ms']:>8.1f}ms "
+                        f"{result['throughput_rps']:>7.2f} req/s peak rss +{result['peak_rss_over_idle_mb']:>6.1f}MB "
+                        f"errors={result['errors']}",
+                        file=sys.stderr,
+                    )
+        finally:
+            stop_process(stub)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
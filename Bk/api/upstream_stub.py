@@ -0,0 +1,234 @@
+"""Local OpenAI-compatible upstream that records real chat completions and replays them offline.
+
+    python upstream_stub.py record recordings.jsonl --port 9100     # proxy to OpenRouter and save each pair
+    python upstream_stub.py replay recordings.jsonl --port 9100 --latency lognormal:0.8,0.4 --error-rate 0.02
+    python upstream_stub.py replay recordings.jsonl --model-faults openai/gpt-4o-mini=503 --model-latency other/model=3
+
+Point the API at it with OPENROUTER_BASE_URL=http://127.0.0.1:9100. Requests are matched on their
+messages with image data blanked out, so any image of the same card type replays the same recording.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+load_dotenv(Path(__file__).resolve().parent / '.env')
+
+def strip_images(payload: dict) -> dict:
+    """Copy of a chat payload with image data replaced, so recordings stay small and image-independent"""
+    messages = []
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            content = [
+                {**part, "image_url": {"url": "<image>"}} if part.get("type") == "image_url" else part
+                for part in content
+            ]
+        messages.append({**message, "content": content})
+    return {**payload, "messages": messages}
+
+def request_key(payload: dict) -> str:
+    # The model is left out so fallback models replay the same recordings
+    messages = strip_images(payload)["messages"]
+    return hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest()
+
+class LatencyModel:
+    """Parses fixed:S, uniform:LO,HI, lognormal:MEDIAN,SIGMA or recorded[:SCALE] into a sampler"""
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, _, args = spec.partition(":")
+        self.kind = kind
+        self.args = [float(a) for a in args.split(",") if a]
+        expected = {"fixed": 1, "uniform": 2, "lognormal": 2, "recorded": (0, 1)}.get(kind)
+        if expected is None:
+            raise ValueError(f"Unknown latency model: {spec}")
+        if len(self.args) not in (expected if isinstance(expected, tuple) else (expected,)):
+            raise ValueError(f"Wrong number of parameters for latency model: {spec}")
+
+    def sample(self, recorded: float = 0.0) -> float:
+        if self.kind == "fixed":
+            return self.args[0]
+        if self.kind == "uniform":
+            return random.uniform(*self.args)
+        if self.kind == "lognormal":
+            median, sigma = self.args
+            return median * random.lognormvariate(0, sigma)
+        return recorded * (self.args[0] if self.args else 1.0)
+
+class RecordingStore:
+    """Recorded request/response pairs from a JSONL file, replayed round-robin per request key"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._by_key: Dict[str, List[dict]] = defaultdict(list)
+        self._all: List[dict] = []
+        self._cursor: Dict[str, int] = defaultdict(int)
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        self._add(json.loads(line))
+
+    def _add(self, record: dict):
+        self._by_key[record["key"]].append(record)
+        self._all.append(record)
+
+    def __len__(self):
+        return len(self._all)
+
+    def lookup(self, key: str) -> Tuple[Optional[dict], bool]:
+        """Returns (record, exact match); unmatched requests get any recording"""
+        records = self._by_key.get(key)
+        exact = bool(records)
+        if not exact:
+            records, key = self._all, ""
+        if not records:
+            return None, False
+        record = records[self._cursor[key] % len(records)]
+        self._cursor[key] += 1
+        return record, exact
+
+    def append(self, record: dict):
+        self._add(record)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+def sse_chunks(body: dict, pieces: int = 20):
+    """Split a recorded completion into streaming deltas"""
+    content = body["choices"][0]["message"].get("content") or ""
+    size = max(1, len(content) // pieces)
+    for i in range(0, len(content), size):
+        yield {"choices": [{"index": 0, "delta": {"content": content[i:i + size]}}]}
+    finish_reason = body["choices"][0].get("finish_reason") or "stop"
+    yield {"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}], "usage": body.get("usage")}
+
+def parse_model_map(spec: str, cast) -> dict:
+    """MODEL=VALUE,MODEL=VALUE as a dict; model names may contain '/' but not '=' or ','"""
+    pairs = (item.rsplit("=", 1) for item in spec.split(",") if item.strip())
+    return {model.strip(): cast(value) for model, value in pairs}
+
+def create_app(
+    mode: str,
+    store: RecordingStore,
+    latency: LatencyModel,
+    error_rate: float = 0.0,
+    error_statuses: Tuple[int, ...] = (429, 500, 503),
+    upstream_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+    model_faults: Optional[Dict[str, int]] = None,
+    model_latency: Optional[Dict[str, float]] = None,
+) -> FastAPI:
+    app = FastAPI()
+    stats = defaultdict(int)
+    client: Optional[httpx.AsyncClient] = None
+
+    async def record(payload: dict) -> Tuple[int, dict]:
+        nonlocal client
+        if client is None:
+            client = httpx.AsyncClient(
+                base_url=upstream_url, timeout=120, headers={"Authorization": f"Bearer {api_key}"}
+            )
+        started = time.perf_counter()
+        # Always record the full completion; streaming is synthesised from it on replay
+        res = await client.post("/chat/completions", json={**payload, "stream": False})
+        elapsed = time.perf_counter() - started
+        body = res.json()
+        if res.status_code == 200:
+            store.append({
+                "key": request_key(payload),
+                "request": strip_images(payload),
+                "status": res.status_code,
+                "response": body,
+                "latency": round(elapsed, 4),
+            })
+            stats["recorded"] += 1
+        return res.status_code, body
+
+    @app.post("/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        model = payload.get("model", "")
+        stats["requests"] += 1
+        stats[f"model:{model}"] += 1
+        if mode == "record":
+            status, body = await record(payload)
+        else:
+            record_, exact = store.lookup(request_key(payload))
+            stats["replayed" if exact else "unmatched"] += 1
+            if record_ is None:
+                return JSONResponse({"error": {"message": "No recordings loaded"}}, status_code=500)
+            await asyncio.sleep(latency.sample(record_.get("latency", 0.0)) + (model_latency or {}).get(model, 0.0))
+            if model in (model_faults or {}):
+                stats["injected_errors"] += 1
+                status = model_faults[model]
+                return JSONResponse({"error": {"message": "Injected fault", "code": status}}, status_code=status)
+            if error_rate and random.random() < error_rate:
+                stats["injected_errors"] += 1
+                status = random.choice(error_statuses)
+                return JSONResponse({"error": {"message": "Injected error", "code": status}}, status_code=status)
+            status, body = record_["status"], record_["response"]
+        if status != 200 or not payload.get("stream"):
+            return JSONResponse(body, status_code=status)
+
+        async def events():
+            for chunk in sse_chunks(body):
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return {"mode": mode, "recordings": len(store), **stats}
+
+    return app
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("mode", choices=("record", "replay"))
+    parser.add_argument("recordings", help="JSONL file of recorded request/response pairs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", default="recorded",
+                        help="fixed:S, uniform:LO,HI, lognormal:MEDIAN,SIGMA or recorded[:SCALE] (replay only)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of replies replaced by an error")
+    parser.add_argument("--error-statuses", default="429,500,503")
+    parser.add_argument("--model-faults", default="", help="MODEL=STATUS,... models that always fail (replay only)")
+    parser.add_argument("--model-latency", default="", help="MODEL=SECONDS,... extra latency per model (replay only)")
+    parser.add_argument("--upstream", default=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+                        help="Real upstream to record from")
+    args = parser.parse_args(argv)
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if args.mode == "record" and not api_key:
+        parser.error("OPENAI_API_KEY is required to record")
+    store = RecordingStore(args.recordings)
+    app = create_app(
+        args.mode,
+        store,
+        LatencyModel(args.latency),
+        error_rate=args.error_rate,
+        error_statuses=tuple(int(s) for s in args.error_statuses.split(",")),
+        upstream_url=args.upstream,
+        api_key=api_key,
+        model_faults=parse_model_map(args.model_faults, int),
+        model_latency=parse_model_map(args.model_latency, float),
+    )
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Differential check and timing of the field validation engine against a reference implementation.
+
+    python validation_check.py --records 60000
+    git show fe654e2^:Bk/api/backk.py > /tmp/reference_backk.py
+    python validation_check.py --records 60000 --reference /tmp/reference_backk.py
+
+validate_date is always compared against the strptime format probing it replaced. With --reference,
+validate_card_fields is also run on the same synthetic records by both modules and the JSON output
+compared byte for byte, and both are timed. Exits 1 on any mismatch.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REFERENCE_DATE_FORMATS = ("%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%m/%d/%Y", "%d.%m.%Y")
+
+def reference_validate_date(date_str):
+    if not date_str:
+        return None, None
+    for fmt in REFERENCE_DATE_FORMATS:
+        try:
+            return datetime.strptime(date_str, fmt).strftime("%d/%m/%Y"), True
+        except ValueError:
+            continue
+    return date_str, False
+
+def random_date(rng: random.Random) -> str:
+    """Valid, invalid and near-miss dates in every accepted layout, plus padding and non-ASCII digits"""
+    part = lambda: rng.choice(["5", "05", " 5", " 12", "12", "13", "29", "30", "31", "0", "00", "٣", "５"])
+    year = rng.choice(["2020", "2021", "1900", "2000", "0000", "0001", "٢٠٢٠", "20", "02020"])
+    sep = rng.choice("/-.")
+    text = rng.choice([
+        f"{part()}{sep}{part()}{sep}{year}", f"{year}-{part()}-{part()}", f"{year}{sep}{part()}{sep}{part()}",
+    ])
+    if rng.random() < 0.1:
+        text = rng.choice([" ", "\n", ""]) + text + rng.choice([" ", "\n", ""])
+    if rng.random() < 0.05:
+        text = "".join(rng.choice("0123456789/-. a") for _ in range(rng.randint(0, 12)))
+    return text
+
+def random_record(rng: random.Random, backk, card_type) -> dict:
+    def value(rule):
+        if rng.random() < 0.1:
+            return None
+        if rule is backk.date_rule:
+            return random_date(rng)
+        return rng.choice(["MH12 20110012345", "ABCDE1234F", "2345 6789 0123", "M", "F", "Other", "x", ""])
+
+    data: dict = {}
+    for path, rule in backk.CARD_SCHEMAS[card_type]:
+        *parents, leaf = path.split(".")
+        node = data
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[leaf] = value(rule)
+    for key, child in list(data.items()):
+        # Nested objects that the model returned as null or a string
+        if isinstance(child, dict) and rng.random() < 0.05:
+            data[key] = rng.choice([None, "n/a"])
+    return {backk.CARD_KEYS[card_type]: data}
+
+def load_module(path: str, name: str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def timed(fn, items) -> float:
+    started = time.perf_counter()
+    for item in items:
+        fn(*item)
+    return time.perf_counter() - started
+
+def check_dates(backk, rng: random.Random, count: int) -> int:
+    mismatches = 0
+    for _ in range(count):
+        text = random_date(rng)
+        expected, actual = reference_validate_date(text), backk.validate_date(text)
+        if expected != actual:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"  date {text!r}: reference {expected} != {actual}")
+    print(f"validate_date: {count} inputs, {mismatches} mismatches")
+    return mismatches
+
+def check_records(backk, reference, records) -> Tuple[int, list]:
+    """Returns the mismatch count and the records the reference could validate"""
+    mismatches, comparable = 0, []
+    for card_type, data in records:
+        # The old validator raised on some malformed records; those are skipped rather than compared
+        try:
+            expected = json.dumps(
+                reference.validate_card_fields(reference.CardType(card_type.value), data), sort_keys=True
+            )
+        except Exception:
+            continue
+        comparable.append((card_type, data))
+        actual = json.dumps(backk.validate_card_fields(card_type, data), sort_keys=True)
+        if expected != actual:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"  {card_type.value}: {json.dumps(data)}\n    reference {expected}\n    current   {actual}")
+    print(f"validate_card_fields: {len(comparable)} of {len(records)} records comparable, {mismatches} mismatches")
+    return mismatches, comparable
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=60000, help="Synthetic records, spread over card types")
+    parser.add_argument("--dates", type=int, default=200000, help="Synthetic date strings")
+    parser.add_argument("--reference", help="Path to an older backk.py to compare validate_card_fields against")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("OPENAI_API_KEY", "validation-check")
+    sys.path.insert(0, HERE)
+    import backk
+
+    rng = random.Random(args.seed)
+    mismatches = check_dates(backk, rng, args.dates)
+
+    card_types = list(backk.CARD_SCHEMAS)
+    records = [(card_type, random_record(rng, backk, card_type))
+               for card_type in (card_types[i % len(card_types)] for i in range(args.records))]
+    if args.reference:
+        reference = load_module(args.reference, "reference_backk")
+        record_mismatches, records = check_records(backk, reference, records)
+        mismatches += record_mismatches
+        # Enum members differ between the two modules, so map by value
+        reference_records = [(reference.CardType(card_type.value), data) for card_type, data in records]
+        reference_time = timed(reference.validate_card_fields, reference_records)
+        current_time = timed(backk.validate_card_fields, records)
+        print(f"reference {reference_time:.2f}s, current {current_time:.2f}s "
+              f"({reference_time / current_time:.1f}x)")
+    else:
+        print(f"validate_card_fields: {timed(backk.validate_card_fields, records):.2f}s for {len(records)} records")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()